@@ -1,4 +1,36 @@
 import json
+import os
+import threading
+
+# The stream, delivery, dead letter and digest threads all use the cache files.
+_lock = threading.Lock()
+
+
+def _load(subreddit: str) -> dict:
+    """
+    Reads the cache file of a subreddit. A missing file is an empty cache. A file that can
+    not be parsed is moved aside instead of being overwritten, so the history can be recovered.
+    """
+    path = f"cache/{subreddit}.json"
+    try:
+        with open(path, "r") as datafile:
+            return json.load(datafile)
+    except FileNotFoundError:
+        return {subreddit: []}
+    except json.JSONDecodeError as e:
+        print(f"Cache file {path} is damaged ({e}), keeping it as {path}.corrupt")
+        os.replace(path, f"{path}.corrupt")
+        return {subreddit: []}
+
+
+def _write(subreddit: str, data: dict):
+    """
+    Replaces the cache file of a subreddit in one step, readers never see a half written file.
+    """
+    path = f"cache/{subreddit}.json"
+    with open(f"{path}.tmp", "w") as datafile:
+        json.dump(data, datafile, indent=4)
+    os.replace(f"{path}.tmp", path)
 
 
 class Cache:
@@ -21,22 +53,10 @@ class Cache:
         """
         subreddit=subreddit.lower()
 
-        try:
-            with open(f"cache/{subreddit}.json","r") as datafile:
-                 cache_data = json.load(datafile)
-
-        except (FileNotFoundError, json.JSONDecodeError):
-            #Reset the cache file
-            with open(f"cache/{subreddit}.json", "w") as datafile:
-                new_data = {subreddit: []}
-                json.dump(new_data, datafile, indent=4)
-            return False
-
-        else:#Search if post_id already exits.
-             if post_id in cache_data[subreddit]:
-                return True
-             else:
-                 return False
+        with _lock:
+            cache_data = _load(subreddit)
+        #Search if post_id already exits.
+        return post_id in cache_data[subreddit]
 
     @staticmethod
     def save_post_id(subreddit,post_id): #new Json for each subreddit in list
@@ -52,19 +72,7 @@ class Cache:
 
         """
         subreddit = subreddit.lower()
-        try:
-            with open(f"cache/{subreddit}.json", "r") as datafile:
-                new_data = (json.load(datafile))
-
-        except:# error in loading.
-            with open(f"cache/{subreddit}.json","w")as datafile:
-                new_data= {subreddit:[]}
-                json.dump(new_data,datafile,indent=4)
-
-        finally:
-            with open(f"cache/{subreddit}.json","w")as datafile:
-                new_data[subreddit].append(post_id)
-                json.dump(new_data, datafile, indent=4)
-
-
-
+        with _lock:
+            new_data = _load(subreddit)
+            new_data[subreddit].append(post_id)
+            _write(subreddit, new_data)
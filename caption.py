@@ -0,0 +1,125 @@
+import html
+import re
+from configparser import ConfigParser
+
+config = ConfigParser()
+config.read("config.ini")
+
+INCLUDE_TITLE = config.getboolean("Telegram", "include_title", fallback=True)
+LINK_TO_POST = config.getboolean("Telegram", "link_to_post", fallback=True)
+SIGN_MESSAGES = config.getboolean("Telegram", "sign_messages", fallback=True)
+CHANNEL_NAME = config.get("Telegram", "channel_name", fallback="")
+CHANNEL_LINK = config.get("Telegram", "channel_link", fallback="")
+
+# Telegram counts the caption limit on the text left after parsing the html, in UTF-16 units.
+CAPTION_LIMIT = 1024
+ELLIPSIS = "…"
+
+_TAG = re.compile(r"<[^>]+>")
+
+
+def text_length(text: str) -> int:
+    """
+    Returns:
+        int: length of plain text the way Telegram counts it.
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+def visible_length(caption: str) -> int:
+    """
+    Returns:
+        int: length of an html caption once Telegram removed the tags and entities.
+    """
+    return text_length(html.unescape(_TAG.sub("", caption)))
+
+
+def truncate(text: str, limit: int) -> str:
+    """
+    Cuts plain text down to limit, ending it with an ellipsis when something was cut.
+    """
+    if text_length(text) <= limit:
+        return text
+    if limit <= 0:
+        return ""
+    cut = text[:limit - 1]
+    # Characters outside the BMP count twice
+    excess = text_length(cut) - (limit - 1)
+    while excess > 0:
+        cut = cut[:len(cut) - (excess + 1) // 2]
+        excess = text_length(cut) - (limit - 1)
+    return cut + ELLIPSIS
+
+
+class CaptionRenderer:
+    """
+    Renders post captions from a template compiled once from the settings. The channel
+    signature and the link markup are built and escaped up front, so a caption only costs
+    escaping the title and filling in the post link.
+    """
+
+    def __init__(self, include_title: bool = INCLUDE_TITLE, link_to_post: bool = LINK_TO_POST,
+                 sign_messages: bool = SIGN_MESSAGES, channel_name: str = CHANNEL_NAME,
+                 channel_link: str = CHANNEL_LINK, limit: int = CAPTION_LIMIT):
+        self.include_title = include_title
+        self.limit = limit
+
+        lines = []
+        static_text = []
+        if include_title:
+            lines.append("{title}")
+        if link_to_post:
+            lines.append('<a href="https://www.reddit.com{permalink}">r/{subreddit}</a>')
+            static_text.append("r/")
+        if sign_messages:
+            signature = f'<a href="{html.escape(channel_link)}">-{html.escape(channel_name)}</a>'
+            lines.append(signature.replace("{", "{{").replace("}", "}}"))
+            static_text.append(f"-{channel_name}")
+
+        self._template = "\n".join(lines)
+        # Visible length of everything but the title and the subreddit name
+        self._static_length = text_length("".join(static_text)) + max(len(lines) - 1, 0)
+        self._link_to_post = link_to_post
+        self._subreddits = {}
+
+    def _subreddit(self, subreddit: str) -> tuple:
+        """
+        Returns:
+            tuple: escaped name and visible length of a subreddit, cached per subreddit.
+        """
+        fragment = self._subreddits.get(subreddit)
+        if fragment is None:
+            fragment = self._subreddits[subreddit] = (html.escape(subreddit), text_length(subreddit))
+        return fragment
+
+    @staticmethod
+    def _title(title: str, limit: int) -> str:
+        """
+        Reddit sends titles with &, < and > already escaped. They are unescaped first so they
+        are not escaped twice and the limit counts the text that is shown.
+        """
+        return html.escape(truncate(html.unescape(title or ""), limit), quote=False)
+
+    def render(self, title: str, permalink: str, subreddit: str) -> str:
+        """
+        Args:
+            title(str): post title as Reddit sends it, escaped here.
+            permalink(str): permalink of the post, starting with /r/.
+            subreddit(str): display name of the subreddit.
+
+        Returns:
+            str: html caption that fits into the caption limit. The title is shortened when needed.
+        """
+        escaped_subreddit, subreddit_length = self._subreddit(subreddit)
+        title_limit = self.limit - self._static_length - (subreddit_length if self._link_to_post else 0)
+        return self._template.format(
+            title=self._title(title, title_limit) if self.include_title else "",
+            permalink=html.escape(permalink or ""),
+            subreddit=escaped_subreddit,
+        )
+
+    def render_submission(self, submission) -> str:
+        return self.render(submission.title, submission.permalink, submission.subreddit.display_name)
+
+
+renderer = CaptionRenderer()
@@ -0,0 +1,219 @@
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+from configparser import ConfigParser
+
+import profiler
+
+config = ConfigParser()
+config.read("config.ini")
+
+MAX_ATTEMPTS = config.getint("DeadLetter", "max_attempts", fallback=5)
+BASE_DELAY = config.getfloat("DeadLetter", "base_delay", fallback=60)
+MAX_DELAY = config.getfloat("DeadLetter", "max_delay", fallback=3600)
+POLL_INTERVAL = config.getfloat("DeadLetter", "poll_interval", fallback=15)
+
+
+class DeadLetterQueue:
+    """
+    Persistent store of deliveries that could not be sent, kept in the /cache folder.
+
+    The file is the source of truth and is re-read on every operation, so the bot and
+    the command line tool can work on the same queue.
+    """
+
+    def __init__(self, path: str = "cache/dead_letter.json"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r") as datafile:
+                return json.load(datafile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, entries: dict):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as datafile:
+            json.dump(entries, datafile, indent=4)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def backoff(attempts: int) -> float:
+        """
+        Full-jitter exponential backoff.
+
+        Args:
+            attempts(int): number of retries made so far.
+
+        Returns:
+            float: seconds to wait before the next retry.
+        """
+        return random.uniform(BASE_DELAY / 2, min(MAX_DELAY, BASE_DELAY * 2 ** attempts))
+
+    def add(self, entry: dict, reason: str):
+        """
+        Stores a failed delivery.
+
+        Args:
+            entry(dict): journal entry of the delivery (see DeliveryJournal.begin).
+            reason(str): why the delivery failed.
+        """
+        with self._lock:
+            entries = self._read()
+            dead_letter = dict(entry)
+            dead_letter.update({
+                "reason": reason,
+                "attempts": 0,
+                "failed_at": time.time(),
+                "next_attempt_at": time.time() + self.backoff(0),
+            })
+            entries[entry["key"]] = dead_letter
+            self._write(entries)
+
+    def contains(self, subreddit: str, post_id: str) -> bool:
+        with self._lock:
+            return f"{subreddit.lower()}/{post_id}" in self._read()
+
+    def get(self, key: str):
+        with self._lock:
+            return self._read().get(key)
+
+    def entries(self) -> list:
+        with self._lock:
+            return list(self._read().values())
+
+    def due(self) -> list:
+        """
+        Returns:
+            list: entries whose next attempt is scheduled now or earlier and that still have attempts left.
+        """
+        now = time.time()
+        return [entry for entry in self.entries()
+                if entry["attempts"] < MAX_ATTEMPTS and entry["next_attempt_at"] <= now]
+
+    def mark_partial(self, key: str, item_index: int):
+        """
+        Records that the media item at item_index has been delivered by a retry.
+        """
+        with self._lock:
+            entries = self._read()
+            if key in entries:
+                entries[key]["sent"] = item_index + 1
+                self._write(entries)
+
+    def record_failure(self, key: str, reason: str):
+        """
+        Counts a failed retry and schedules the next one.
+        """
+        with self._lock:
+            entries = self._read()
+            if key not in entries:
+                return
+            entry = entries[key]
+            entry["attempts"] += 1
+            entry["reason"] = reason
+            entry["next_attempt_at"] = time.time() + self.backoff(entry["attempts"])
+            self._write(entries)
+
+    def remove(self, key: str) -> bool:
+        with self._lock:
+            entries = self._read()
+            if entries.pop(key, None) is None:
+                return False
+            self._write(entries)
+            return True
+
+
+class DeadLetterRetrier(threading.Thread):
+    """
+    Background thread that retries due dead letters without blocking the stream.
+    """
+
+    def __init__(self, queue: DeadLetterQueue, retry_function):
+        """
+        Args:
+            queue(DeadLetterQueue): queue to work through.
+            retry_function(callable): takes a dead letter entry and returns True once it has been delivered.
+        """
+        super().__init__(name="dead-letter-retrier", daemon=True)
+        self.queue = queue
+        self.retry_function = retry_function
+
+    def run(self):
+        while True:
+            for entry in self.queue.due():
+                print(f"Retrying dead letter {entry['key']} (attempt {entry['attempts'] + 1}/{MAX_ATTEMPTS})")
+                try:
+                    self.retry_function(entry)
+                except Exception as e:
+                    self.queue.record_failure(entry["key"], str(e))
+            profiler.capture.sleep(POLL_INTERVAL)
+
+
+def _print_entry(entry: dict):
+    next_attempt = "exhausted" if entry["attempts"] >= MAX_ATTEMPTS else \
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["next_attempt_at"]))
+    print(f"{entry['key']}  items={entry['sent']}/{len(entry['media_items'])}  "
+          f"attempts={entry['attempts']}  next={next_attempt}  reason={entry['reason']}")
+
+
+def cli(args: list):
+    """
+    Usage:
+        python dead_letter.py list
+        python dead_letter.py show <key>
+        python dead_letter.py replay <key>|all
+        python dead_letter.py drop <key>
+    """
+    # Sharded workers keep one queue file each
+    queues = [DeadLetterQueue(path) for path in sorted(glob.glob("cache/dead_letter*.json"))]
+    command = args[0] if args else "list"
+
+    def find(key):
+        for queue in queues:
+            entry = queue.get(key)
+            if entry:
+                return queue, entry
+        print(f"No dead letter {key}")
+        return None, None
+
+    if command == "list":
+        entries = [entry for queue in queues for entry in queue.entries()]
+        for entry in entries:
+            _print_entry(entry)
+        print(f"{len(entries)} dead letter(s)")
+
+    elif command == "show" and len(args) == 2:
+        queue, entry = find(args[1])
+        if entry:
+            print(json.dumps(entry, indent=4))
+
+    elif command == "replay" and len(args) == 2:
+        from main import retry_dead_letter  # Loads the bot configuration and handlers.
+
+        if args[1] == "all":
+            targets = [(queue, entry) for queue in queues for entry in queue.entries()]
+        else:
+            targets = [target for target in [find(args[1])] if target[0]]
+        for queue, entry in targets:
+            delivered = retry_dead_letter(entry, queue)
+            print(f"{entry['key']}: {'delivered' if delivered else 'failed'}")
+
+    elif command == "drop" and len(args) == 2:
+        queue, entry = find(args[1])
+        if entry:
+            queue.remove(args[1])
+            print("Dropped")
+
+    else:
+        print(cli.__doc__)
+
+
+if __name__ == "__main__":
+    cli(sys.argv[1:])
@@ -0,0 +1,111 @@
+import threading
+import time
+from configparser import ConfigParser
+from typing import List
+
+import profiler
+from caption import CAPTION_LIMIT, visible_length
+
+config = ConfigParser()
+config.read("config.ini")
+
+ENABLED = config.getboolean("Digest", "enabled", fallback=False)
+WINDOW_SECONDS = config.getfloat("Digest", "window_seconds", fallback=300)
+MAX_POSTS = config.getint("Digest", "max_posts", fallback=10)
+
+MEDIA_GROUP_LIMIT = 10
+# Telegram only accepts photos and videos in a mixed album.
+ALBUM_MEDIA_TYPES = ("photo", "video")
+
+
+def can_be_digested(entry: dict) -> bool:
+    """
+    Only untouched posts that fit into a single album are buffered, everything else is
+    sent on its own so a post is never split over several messages.
+    """
+    media_items = entry["media_items"]
+    return entry["sent"] == 0 and len(media_items) <= MEDIA_GROUP_LIMIT \
+        and all(item[0] in ALBUM_MEDIA_TYPES for item in media_items)
+
+
+def pack_albums(entries: List[dict]) -> List[dict]:
+    """
+    Packs posts into as few albums as possible. A post always stays in one album and the
+    album caption is the captions of its posts, kept inside Telegram's caption limit.
+
+    Returns:
+        list: dicts with "media" (the sendMediaGroup media list) and "entries" (posts in the album).
+    """
+    albums = []
+    current = {"media": [], "entries": [], "captions": []}
+
+    def close():
+        if current["media"]:
+            current["media"][0]["caption"] = "\n\n".join(current["captions"])
+            albums.append({"media": current["media"], "entries": current["entries"]})
+
+    for entry in entries:
+        captions = current["captions"] + [entry["caption"]]
+        if len(current["media"]) + len(entry["media_items"]) > MEDIA_GROUP_LIMIT \
+                or visible_length("\n\n".join(captions)) > CAPTION_LIMIT:
+            close()
+            current = {"media": [], "entries": [], "captions": []}
+
+        for media_type, url, _ in entry["media_items"]:
+            current["media"].append({"type": media_type, "media": url, "parse_mode": "HTML"})
+        current["entries"].append(entry)
+        current["captions"].append(entry["caption"])
+    close()
+    return albums
+
+
+class DigestBuffer(threading.Thread):
+    """
+    Collects deliveries for the channel and hands them to flush_function in one batch once
+    the oldest one has waited WINDOW_SECONDS or MAX_POSTS have been collected.
+    """
+
+    def __init__(self, flush_function, window_seconds: float = WINDOW_SECONDS, max_posts: int = MAX_POSTS):
+        """
+        Args:
+            flush_function(callable): receives the list of buffered journal entries.
+            window_seconds(float): longest time a post waits in the buffer.
+            max_posts(int): number of posts that triggers a flush right away.
+        """
+        super().__init__(name="digest", daemon=True)
+        self.flush_function = flush_function
+        self.window_seconds = window_seconds
+        self.max_posts = max_posts
+        self._entries = []
+        self._first_added_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def add(self, entry: dict):
+        with self._lock:
+            if not self._entries:
+                self._first_added_at = time.monotonic()
+            self._entries.append(entry)
+            full = len(self._entries) >= self.max_posts
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries, self._entries = self._entries, []
+        if entries:
+            self.flush_function(entries)
+
+    def run(self):
+        while True:
+            profiler.capture.sleep(1)
+            with self._lock:
+                due = self._entries and time.monotonic() - self._first_added_at >= self.window_seconds
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error flushing digest: {e}")
@@ -0,0 +1,218 @@
+import argparse
+import atexit
+import cProfile
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+def serialize_submission(submission) -> dict:
+    """
+    Turns a PRAW submission into plain json data. Related objects are replaced by their names.
+    """
+    data = {}
+    for key, value in vars(submission).items():
+        if key.startswith("_"):
+            continue
+        if key == "subreddit":
+            value = value.display_name
+        elif key == "author":
+            value = value.name if value else None
+        data[key] = value
+    return data
+
+
+class FeedRecorder:
+    """
+    Writes every submission seen by the stream to a gzip compressed json lines file.
+
+    Every run gets its own file, named after path with the start time added, because
+    a gzip stream appended after one that was cut off can not be read. Each line is
+    flushed, so a recording stays readable up to its last line when the bot is killed.
+    """
+
+    def __init__(self, path: str):
+        self.path = self.run_path(path)
+        self._lock = threading.Lock()
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        atexit.register(self.close)
+
+    @staticmethod
+    def run_path(path: str) -> str:
+        """
+        Returns:
+            str: path with the current time before its extension, eg- cache/feed-20240101-120000.jsonl.gz
+        """
+        folder, filename = os.path.split(path)
+        name, dot, extension = filename.partition(".")
+        return os.path.join(folder, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}{dot}{extension}")
+
+    def record(self, submission):
+        line = json.dumps({"received_at": time.time(), "submission": serialize_submission(submission)}, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplaySubmission:
+    """
+    Stands in for a PRAW submission built from a recorded line. Fields that were not
+    recorded read as None instead of triggering a fetch.
+    """
+
+    def __init__(self, data: dict):
+        self.__dict__.update(data)
+        self.subreddit = SimpleNamespace(display_name=data["subreddit"])
+        self.author = SimpleNamespace(name=data["author"]) if data.get("author") else None
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+
+def read_feed(path: str):
+    """
+    Yields (received_at, ReplaySubmission) from a recorded feed.
+    """
+    records = 0
+    with gzip.open(path, "rt", encoding="utf-8") as feed:
+        try:
+            for line in feed:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # Line torn by a crash in the middle of writing it
+                    continue
+                records += 1
+                yield record["received_at"], ReplaySubmission(record["submission"])
+        except (EOFError, zlib.error) as e:
+            # Recording of a bot that was killed: no gzip end marker (every flushed line is read)
+            # or, in recordings from older versions, another gzip stream appended after it
+            print(f"{path} is cut off ({e}), stopping after {records} records")
+
+
+class StubTelegramServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Bot API that accepts every request after an optional delay.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), _StubTelegramHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _StubTelegramHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server._lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        body = json.dumps({"ok": True, "result": {"message_id": self.server.requests}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def replay(path: str, speed: float, latency: float, rate_limit: bool = False):
+    """
+    Feeds a recorded feed through main.process_submission against the stub Bot API.
+    Repost cache, journal and dead letters go to a temporary folder so production state
+    is never touched. Network probes and preprocessing are switched off.
+
+    Args:
+        path(str): recorded feed.
+        speed(float): replay speed relative to the recording, 0 replays as fast as possible.
+        latency(float): seconds the stub waits before answering a request.
+        rate_limit(bool): keep the client side limit of bot_messages_per_second. Off by
+                          default, otherwise the throughput only measures the limiter.
+    """
+    import main
+    from dead_letter import DeadLetterQueue
+    from shared_store import SharedStore
+    from telegram_handler import TelegramHandler
+
+    server = StubTelegramServer(latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    main.tg = TelegramHandler(main.chat_id, api_url=server.url)
+    if not rate_limit:
+        main.tg.set_rate_limit(0)
+    main.cache = main.journal = SharedStore(os.path.join(workdir, "store.db"))
+    main.dead_letters = DeadLetterQueue(os.path.join(workdir, "dead_letter.json"))
+    main.probe = None
+    main.preprocessor = None
+
+    threading.Thread(target=main.delivery_worker, name="delivery", daemon=True).start()
+    if main.digest_buffer:
+        main.digest_buffer.start()
+
+    submissions = 0
+    start = time.monotonic()
+    first_received_at = None
+    for received_at, submission in read_feed(path):
+        if first_received_at is None:
+            first_received_at = received_at
+        if speed > 0:
+            wait = (received_at - first_received_at) / speed - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+        main.process_submission(submission)
+        submissions += 1
+    fed = time.monotonic() - start
+
+    main.delivery_queue.join()
+    if main.digest_buffer:
+        main.digest_buffer.flush()
+    elapsed = time.monotonic() - start
+    server.shutdown()
+
+    print(f"Replayed {submissions} submissions in {elapsed:.2f}s (fed in {fed:.2f}s)")
+    print(f"{submissions / elapsed:.1f} submissions/s, {server.requests} Telegram requests "
+          f"({server.requests / elapsed:.1f}/s)")
+    print(f"Replay state kept in {workdir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded submission feed against a stub Telegram API.",
+        epilog="Posts are dropped as stale by their age at replay time, so a non-zero max_age in the "
+               "[Priority] section treats every post of an older recording as stale. Set it to 0 for replays.")
+    parser.add_argument("feed", help="recorded .jsonl.gz feed")
+    parser.add_argument("--speed", default="1",
+                        help="replay speed, 1 = as recorded, 10 = ten times faster, max = no waiting")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stub takes per request")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the client side bot_messages_per_second limit (off by default)")
+    parser.add_argument("--profile", help="write a cProfile of the replay to this file")
+    args = parser.parse_args()
+
+    replay_speed = 0 if args.speed == "max" else float(args.speed)
+    if args.profile:
+        cProfile.run("replay(args.feed, replay_speed, args.latency, args.rate_limit)", args.profile)
+        print(f"Profile written to {args.profile}")
+    else:
+        replay(args.feed, replay_speed, args.latency, args.rate_limit)
@@ -0,0 +1,27 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, List
+
+
+def when_all(futures: List[Future], callback: Callable[[List[Future]], None]):
+    """
+    Calls callback(futures) once every future is done, on the thread that finished the
+    last one. The caller never waits. Reading the results, and handling their errors, is
+    left to the callback.
+    """
+    if not futures:
+        callback(futures)
+        return
+
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        callback(futures)
+
+    for future in futures:
+        future.add_done_callback(on_done)
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+config = ConfigParser()
+config.read("config.ini")
+
+ENABLED = config.getboolean("Health", "enabled", fallback=False)
+HOST = config.get("Health", "host", fallback="127.0.0.1")
+PORT = config.getint("Health", "port", fallback=8080)
+# The stream is restarted when no submission arrived for watchdog_multiplier times the
+# expected gap between two posts, kept between the min and max window.
+WATCHDOG_MULTIPLIER = config.getfloat("Health", "watchdog_multiplier", fallback=10)
+WATCHDOG_MIN_WINDOW = config.getfloat("Health", "watchdog_min_window", fallback=300)
+WATCHDOG_MAX_WINDOW = config.getfloat("Health", "watchdog_max_window", fallback=6 * 3600)
+# Weight of the newest gap in the moving average of the gaps between posts of a subreddit.
+RATE_SMOOTHING = 0.2
+
+
+class HealthState:
+    """
+    Liveness data of the bot and the adaptive stall detection of the submission stream.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.stream_started_at = time.monotonic()
+        self.last_submission_at = None
+        self.last_send_at = None
+        self._last_submission_monotonic = 0.0
+        self.stream_restarts = 0
+        self._last_created = {}
+        self._mean_gap = {}
+        self._metrics = {}
+
+    def register_metric(self, name: str, function):
+        """
+        Adds a value to the health report. function is called on every request.
+        """
+        self._metrics[name] = function
+
+    def stream_started(self):
+        with self._lock:
+            self.stream_started_at = time.monotonic()
+
+    def record_submission(self, subreddit: str, created_utc: float = None):
+        """
+        Called for every submission the stream yields. Updates the post rate of the subreddit.
+        """
+        subreddit = subreddit.lower()
+        with self._lock:
+            self.last_submission_at = time.time()
+            self._last_submission_monotonic = time.monotonic()
+            if not created_utc:
+                return
+            previous = self._last_created.get(subreddit)
+            if previous is None or created_utc <= previous:
+                self._last_created[subreddit] = max(created_utc, previous or 0)
+                return
+            gap = created_utc - previous
+            mean_gap = self._mean_gap.get(subreddit)
+            self._mean_gap[subreddit] = gap if mean_gap is None else \
+                (1 - RATE_SMOOTHING) * mean_gap + RATE_SMOOTHING * gap
+            self._last_created[subreddit] = created_utc
+
+    def record_send(self):
+        with self._lock:
+            self.last_send_at = time.time()
+
+    def watchdog_window(self) -> float:
+        """
+        Returns:
+            float: seconds without submissions after which the stream counts as stalled.
+        """
+        with self._lock:
+            rates = [1 / gap for gap in self._mean_gap.values() if gap > 0]
+        if not rates:
+            return WATCHDOG_MAX_WINDOW
+        expected_gap = 1 / sum(rates)
+        return min(WATCHDOG_MAX_WINDOW, max(WATCHDOG_MIN_WINDOW, WATCHDOG_MULTIPLIER * expected_gap))
+
+    def stream_stalled(self) -> bool:
+        with self._lock:
+            last_activity = max(self.stream_started_at, self._last_submission_monotonic)
+        return time.monotonic() - last_activity > self.watchdog_window()
+
+    def report(self) -> dict:
+        with self._lock:
+            report = {
+                "uptime_seconds": round(time.time() - self.started_at),
+                "last_submission_at": self.last_submission_at,
+                "last_send_at": self.last_send_at,
+                "stream_restarts": self.stream_restarts,
+                "mean_post_gap_seconds": {name: round(gap, 1) for name, gap in self._mean_gap.items()},
+            }
+        report["watchdog_window_seconds"] = round(self.watchdog_window())
+        report["stream_stalled"] = self.stream_stalled()
+        for name, function in self._metrics.items():
+            try:
+                report[name] = function()
+            except Exception as e:
+                report[name] = f"error: {e}"
+        return report
+
+
+class HealthServer(ThreadingHTTPServer):
+    """
+    Local http endpoint. /health always answers with the report, /ready answers 503 while
+    the stream is stalled.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, state: HealthState, host: str = HOST, port: int = PORT):
+        self.state = state
+        super().__init__((host, port), _HealthRequestHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="health", daemon=True).start()
+        print(f"Health endpoint listening on http://{self.server_address[0]}:{self.server_address[1]}/health")
+
+
+class _HealthRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/health", "/ready"):
+            self.send_error(404)
+            return
+
+        report = self.server.state.report()
+        status = 503 if self.path == "/ready" and report["stream_stalled"] else 200
+        body = json.dumps(report, indent=4, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -1,21 +1,104 @@
 import json
+import os
 import time
 import re
+import multiprocessing
+import itertools
+import queue
+import threading
 from configparser import ConfigParser
 from telegram_handler import TelegramHandler
 from reddit_handler import RedditHandler
 from cache import Cache
+from journal import DeliveryJournal
+from dead_letter import DeadLetterQueue, DeadLetterRetrier
+from shared_store import SharedStore
+from sharding import LeaseKeeper, subreddits_for_shard
+import media_preprocessor
+from media_extractor import extract_media_items
+import media_probe
+from media_probe import MediaProbe
+import digest
+import priority
+from feed_replay import FeedRecorder
+import profiler
+import health
+from health import HealthServer, HealthState
+from reddit_budget import budget
+from caption import renderer as caption_renderer
+from digest import DigestBuffer, can_be_digested, pack_albums
+from media_preprocessor import MediaPreprocessor, discard_local_files
 from datetime import datetime, timezone
 
 # ------Loading Data from the Config File----------
 config = ConfigParser()
 config.read("config.ini")
 
+SUBREDDITS = [s.strip() for s in config["Reddit"]["subreddits"].split(",")]
+SHARD_COUNT = config.getint("Sharding", "workers", fallback=1)
+SHARED_STORE_PATH = config.get("Sharding", "store_path", fallback="cache/shared_store.db")
+LEASE_SECONDS = config.getfloat("Sharding", "lease_seconds", fallback=60)
+HEALTH_PORT = health.PORT
+
 # Initialize global handlers
 chat_id = config["Telegram"]["chat_id"]
 tg = TelegramHandler(chat_id=chat_id)
 reddit = RedditHandler()  # Added this line
-cache = Cache()
+
+# Several worker processes share one SQLite store, a single process uses the json files
+if SHARD_COUNT > 1:
+    cache = journal = SharedStore(SHARED_STORE_PATH)
+else:
+    cache = Cache()
+    journal = DeliveryJournal()
+dead_letters = DeadLetterQueue()
+
+# Deliveries are sent by a separate thread so the stream never waits on Telegram or preprocessing.
+# The most important post is sent first, see priority.py.
+delivery_queue = queue.PriorityQueue()
+delivery_sequence = itertools.count()  # Keeps equal priorities in arrival order
+preprocessor = MediaPreprocessor() if media_preprocessor.ENABLED else None
+# Posts whose media is being probed, they are not in the journal yet
+probing = set()
+probing_lock = threading.Lock()
+
+def deliver_digest(entries):
+    """Send buffered posts packed into albums, posts of a failed album are sent one by one"""
+    for album in pack_albums(entries):
+        if len(album["media"]) == 1:
+            # sendMediaGroup needs at least two items
+            deliver(album["entries"][0])
+            continue
+
+        if tg.send_media_group(album["media"]):
+            for entry in album["entries"]:
+                cache.save_post_id(entry["subreddit"], entry["post_id"])
+                journal.mark_done(entry["subreddit"], entry["post_id"])
+                discard_local_files(entry["media_items"])
+            health_state.record_send()
+            print(f"Successfully forwarded digest album with {len(album['entries'])} posts")
+        else:
+            for entry in album["entries"]:
+                deliver(entry)
+
+# Raw submissions can be recorded for feed_replay.py
+RECORD_PATH = config.get("Replay", "record_path", fallback="")
+recorder = None
+
+# Liveness data for the health endpoint and the stream watchdog
+health_state = HealthState()
+
+# Posts are collected and sent as albums when digest mode is on
+digest_buffer = DigestBuffer(deliver_digest) if digest.ENABLED else None
+
+# Oversized photos are shrunk by the preprocessor, so only the other size limits apply then
+if media_probe.ENABLED:
+    probe_size_limits = dict(media_probe.URL_SIZE_LIMITS)
+    if preprocessor:
+        del probe_size_limits["photo"]
+    probe = MediaProbe(size_limits=probe_size_limits)
+else:
+    probe = None
 
 def create_flair_pattern(flair_text):
     """Creates a pattern that matches flair text with or without emoji prefix"""
@@ -68,40 +151,12 @@ def format_post_title(original_title, media_count=None, user_login=None):
     
     return "\n".join(title_parts)
 
-def collect_media_items(submission):
-    """Collect all media items from a submission"""
-    media_items = []
-    
-    try:
-        if hasattr(submission, 'gallery_data') and hasattr(submission, 'media_metadata'):
-            for item in submission.gallery_data['items']:
-                media_id = item['media_id']
-                if media_id in submission.media_metadata:
-                    metadata = submission.media_metadata[media_id]
-                    if metadata['status'] == 'valid':
-                        if metadata['e'] == 'Image':
-                            url = metadata['s']['u'].replace("amp;", "")
-                            media_items.append(('photo', url))
-                        elif metadata['e'] == 'AnimatedImage':
-                            url = metadata['s']['gif'].replace("amp;", "")
-                            media_items.append(('animation', url))
-        elif submission.url.lower().split('.')[-1] in ['jpg', 'jpeg', 'png', 'webp']:
-            media_items.append(('photo', submission.url))
-        elif submission.url.lower().split('.')[-1] in ['gif', 'gifv', 'mp4']:
-            media_items.append(('animation', submission.url))
-        elif hasattr(submission, 'is_video') and submission.is_video:
-            if submission.media and 'reddit_video' in submission.media:
-                url = submission.media['reddit_video']['fallback_url']
-                media_items.append(('video', url))
-    except Exception as e:
-        print(f"Error collecting media items: {e}")
-    
-    return media_items
-
 def process_submission(submission):
     """Process a single Reddit submission with support for multiple media"""
     try:
-        if Cache.is_a_repost(submission.subreddit.display_name, submission.id):
+        subreddit = submission.subreddit.display_name
+        if cache.is_a_repost(subreddit, submission.id) or journal.is_open(subreddit, submission.id) \
+                or dead_letters.contains(subreddit, submission.id):
             return None
 
         post_flair = submission.link_flair_text.strip() if submission.link_flair_text else ""
@@ -110,111 +165,325 @@ def process_submission(submission):
             return None
 
         # Collect all media items first
-        media_items = collect_media_items(submission)
+        media_items = extract_media_items(submission, only_images=config.getboolean("Telegram", "only_images", fallback=False))
         if not media_items:
             return None
 
-        Cache.save_post_id(submission.subreddit.display_name, submission.id)
-        
-        # Just use the plain title without any additional formatting
-        caption = submission.title
-        
-        # Only add subreddit link and channel signature if configured
-        if config.getboolean("Telegram", "link_to_post", fallback=True):
-            caption += f'\n<a href="https://www.reddit.com{submission.permalink}">r/{submission.subreddit.display_name}</a>'
-        if config.getboolean("Telegram", "sign_messages", fallback=True):
-            caption += f'\n<a href="{config["Telegram"]["channel_link"]}">-{config["Telegram"]["channel_name"]}</a>'
-
-        # Send all media items
-        success = send_media_items(media_items, caption)
-        
-        if success:
-            print(f"Successfully forwarded post with {len(media_items)} media items")
-            return True
+        post = {
+            "subreddit": subreddit,
+            "post_id": submission.id,
+            "caption": caption_renderer.render(submission.title, submission.permalink, subreddit),
+            "created_utc": getattr(submission, 'created_utc', None),
+            "score": getattr(submission, 'score', 0),
+        }
+        if probe:
+            # Drop dead media before Telegram ever sees it. Probing runs on the probe threads,
+            # the journal entry is written once the item list is final.
+            key = f"{subreddit.lower()}/{submission.id}"
+            with probing_lock:
+                if key in probing:
+                    return None
+                probing.add(key)
+            probe.submit(media_items, lambda usable_items: begin_delivery(post, usable_items, key))
         else:
-            print("Failed to forward post")
-            return False
+            begin_delivery(post, media_items)
+        return True
 
     except Exception as e:
         print(f"Error processing submission: {e}")
         return None
 
-def send_media_items(media_items, caption):
-    """Send all media items with proper error handling"""
+def begin_delivery(post, media_items, probing_key=None):
+    """Record a post in the journal and hand it over to the delivery thread"""
     try:
-        # Send first item with just the title as caption
-        first_item = media_items[0]
-        success = False
-        
-        if first_item[0] == 'photo':
-            success = tg.send_photo(first_item[1], caption)
-        elif first_item[0] == 'animation':
-            success = tg.send_animation(first_item[1], caption)
-        elif first_item[0] == 'video':
-            success = tg.send_video(first_item[1], caption)
-            
-        if not success:
+        if not media_items:
+            print(f"No usable media left in {post['subreddit']}/{post['post_id']}")
+            return
+        # Record the delivery before sending anything so a crash can be resumed
+        entry = journal.begin(post["subreddit"], post["post_id"], media_items, post["caption"],
+                              created_utc=post["created_utc"], score=post["score"])
+        enqueue_delivery(entry)
+    except Exception as e:
+        print(f"Error starting delivery of {post['subreddit']}/{post['post_id']}: {e}")
+    finally:
+        if probing_key:
+            with probing_lock:
+                probing.discard(probing_key)
+
+def queue_for_delivery(entry):
+    """Put a delivery into the priority queue of the delivery thread"""
+    delivery_queue.put((-priority.priority(entry), next(delivery_sequence), entry))
+
+def enqueue_delivery(entry):
+    """Hand a journal entry over to the delivery thread, preprocessing its media first if enabled"""
+    if preprocessor:
+        preprocessor.submit(entry, queue_for_delivery)
+    else:
+        queue_for_delivery(entry)
+
+def delivery_worker():
+    """Send queued deliveries one after another"""
+    while True:
+        try:
+            profiler.capture.poll()
+        except Exception as e:
+            print(f"Profiling failed: {e}")
+        try:
+            # Wake up regularly so a profile capture of this thread ends on time
+            _, _, entry = delivery_queue.get(timeout=profiler.POLL_STEP)
+        except queue.Empty:
+            continue
+        try:
+            if priority.is_stale(entry):
+                # Too old to be worth sending, close it so it is not fetched again
+                cache.save_post_id(entry["subreddit"], entry["post_id"])
+                journal.mark_done(entry["subreddit"], entry["post_id"])
+                discard_local_files(entry["media_items"])
+                print(f"Dropped stale post {entry['key']}")
+            elif digest_buffer and can_be_digested(entry):
+                digest_buffer.add(entry)
+            else:
+                deliver(entry)
+        except Exception as e:
+            print(f"Error delivering {entry['key']}: {e}")
+        finally:
+            delivery_queue.task_done()
+
+def deliver(entry):
+    """Send the media of a journal entry, starting from the first unsent item"""
+    subreddit, post_id = entry["subreddit"], entry["post_id"]
+    media_items = entry["media_items"]
+
+    def on_item_sent(index):
+        entry["sent"] = index + 1
+        journal.mark_partial(subreddit, post_id, index)
+
+    tg.last_error = None
+    success = send_media_items(media_items, entry["caption"], start_index=entry["sent"], on_item_sent=on_item_sent)
+
+    if success:
+        cache.save_post_id(subreddit, post_id)
+        journal.mark_done(subreddit, post_id)
+        discard_local_files(media_items)
+        health_state.record_send()
+        print(f"Successfully forwarded post with {len(media_items)} media items")
+        return True
+    else:
+        # Hand the delivery over to the dead letter queue before closing it in the journal
+        dead_letters.add(entry, tg.last_error or "send failed")
+        journal.mark_done(subreddit, post_id)
+        print(f"Failed to forward post, moved {entry['key']} to the dead letter queue")
+        return False
+
+def retry_dead_letter(entry, dead_letter_queue=None):
+    """Retry a delivery from the dead letter queue, continuing after the last sent item"""
+    dead_letter_queue = dead_letter_queue or dead_letters
+    tg.last_error = None
+    success = send_media_items(
+        entry["media_items"],
+        entry["caption"],
+        start_index=entry["sent"],
+        on_item_sent=lambda index: dead_letter_queue.mark_partial(entry["key"], index),
+    )
+
+    if success:
+        cache.save_post_id(entry["subreddit"], entry["post_id"])
+        dead_letter_queue.remove(entry["key"])
+        discard_local_files(entry["media_items"])
+        health_state.record_send()
+        print(f"Delivered dead letter {entry['key']}")
+    else:
+        dead_letter_queue.record_failure(entry["key"], tg.last_error or "send failed")
+    return success
+
+def resume_deliveries(subreddits):
+    """Finish deliveries that were interrupted by a crash or restart"""
+    served = {s.lower() for s in subreddits}
+    for entry in journal.unfinished():
+        if entry["subreddit"].lower() not in served:
+            # Belongs to another shard
+            continue
+        if cache.is_a_repost(entry["subreddit"], entry["post_id"]):
+            # Crashed after the last item was sent but before the journal was closed
+            journal.mark_done(entry["subreddit"], entry["post_id"])
+            continue
+
+        print(f"Resuming delivery of {entry['key']} from item {entry['sent'] + 1}/{len(entry['media_items'])}")
+        enqueue_delivery(entry)
+
+def send_media_item(media_type, url, caption, fallback_urls=()):
+    """
+    Send a single media item with the matching Telegram method.
+    If Telegram rejects the chosen rendition, the larger fallback renditions are tried in order.
+    """
+    ladder = [url, *fallback_urls]
+    for position, rendition_url in enumerate(ladder):
+        if media_type == 'photo':
+            success = tg.send_photo(rendition_url, caption)
+        elif media_type == 'animation':
+            success = tg.send_animation(rendition_url, caption)
+        elif media_type == 'video':
+            success = tg.send_video(rendition_url, caption)
+        else:
             return False
 
-        # Send remaining items without any caption
-        for media_type, url in media_items[1:]:
-            max_retries = 3
-            retry_delay = 5
-            
-            for attempt in range(max_retries):
-                try:
-                    success = False
-                    if media_type == 'photo':
-                        success = tg.send_photo(url, "")
-                    elif media_type == 'animation':
-                        success = tg.send_animation(url, "")
-                    elif media_type == 'video':
-                        success = tg.send_video(url, "")
-                        
-                    if success:
-                        break
-                        
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        print(f"Attempt {attempt + 1} failed: {e}")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                    else:
-                        print(f"Failed to send media item after {max_retries} attempts")
-                        return False
-                
-                time.sleep(1)  # Rate limiting delay
-                
+        if success:
+            return True
+        if position < len(ladder) - 1:
+            print(f"Rendition {rendition_url} failed, trying the next larger one")
+    return False
+
+def send_media_items(media_items, caption, start_index=0, on_item_sent=None):
+    """
+    Send all media items with proper error handling.
+
+    Only the first item carries the caption. start_index skips items that were already
+    delivered and on_item_sent(index) is called after every successfully sent item.
+    """
+    try:
+        for index in range(start_index, len(media_items)):
+            media_type, url, fallback_urls = media_items[index]
+
+            if index == 0:
+                # Send first item with just the title as caption
+                if not send_media_item(media_type, url, caption, fallback_urls):
+                    return False
+            else:
+                # Send remaining items without any caption
+                max_retries = 3
+                retry_delay = 5
+
+                for attempt in range(max_retries):
+                    try:
+                        if send_media_item(media_type, url, "", fallback_urls):
+                            break
+
+                    except Exception as e:
+                        if attempt < max_retries - 1:
+                            print(f"Attempt {attempt + 1} failed: {e}")
+                            time.sleep(retry_delay)
+                            retry_delay *= 2
+                        else:
+                            print(f"Failed to send media item after {max_retries} attempts")
+                            return False
+
+                    time.sleep(1)  # Rate limiting delay
+                else:
+                    print(f"Failed to send media item after {max_retries} attempts")
+                    return False
+
+            if on_item_sent:
+                on_item_sent(index)
+
         return True
         
     except Exception as e:
         print(f"Error sending media items: {e}")
+        tg.last_error = tg.last_error or f"Error sending media items: {e}"
         return False
 
-    except Exception as e:
-        print(f"Error processing submission: {e}")
-        return None
-
-def stream_subreddits():
+def stream_subreddits(subreddits=None):
     """Stream new posts from configured subreddits"""
-    subreddits = [s.strip() for s in config["Reddit"]["subreddits"].split(",")]
+    subreddits = subreddits or SUBREDDITS
     multi_subreddit = "+".join(subreddits)
     
     print(f"Starting to stream posts from: {multi_subreddit}")
     print(f"Watching for posts with these flairs: {[pattern.pattern[1:-1] for pattern in desired_flairs]}")
-    
+
+    profiler.install(globals())
+    threading.Thread(target=delivery_worker, name="delivery", daemon=True).start()
+    if digest_buffer:
+        digest_buffer.start()
+    resume_deliveries(subreddits)
+    DeadLetterRetrier(dead_letters, retry_dead_letter).start()
+
+    global recorder
+    if RECORD_PATH:
+        recorder = FeedRecorder(RECORD_PATH)
+        print(f"Recording submissions to {recorder.path}")
+
+    if health.ENABLED:
+        health_state.register_metric("queue_depth", lambda: delivery_queue.qsize() + (len(digest_buffer) if digest_buffer else 0))
+        health_state.register_metric("reddit_budget", budget.headroom)
+        health_state.register_metric("bot_pool", tg.pool_status)
+        if profiler.TIMING_ENABLED:
+            health_state.register_metric("wall_times", profiler.wall_times.snapshot)
+        HealthServer(health_state, port=HEALTH_PORT).start()
+
+    skip_existing = True
     while True:
         try:
-            for submission in reddit.get_submission_stream():
+            health_state.stream_started()
+            # pause_after=0 yields None after every empty poll so the watchdog gets to run
+            for submission in reddit.get_submission_stream(subreddits, skip_existing=skip_existing, pause_after=0):
+                # Polls and lazy loads of the last submission go through the same client,
+                # space out the next request once any of them used the quota
+                if budget.new_responses():
+                    budget.throttle()
+                profiler.capture.poll()
+                if submission is None:
+                    if health_state.stream_stalled():
+                        print(f"No submissions for {health_state.watchdog_window():.0f} seconds, restarting stream")
+                        break
+                    continue
+
+                health_state.record_submission(submission.subreddit.display_name,
+                                               getattr(submission, 'created_utc', None))
+                if recorder:
+                    recorder.record(submission)
                 process_submission(submission)
         except Exception as e:
             print(f"Stream interrupted: {e}")
-            print("Restarting stream in 30 seconds...")
-            time.sleep(30)
+            # A restart refetches the latest posts, wait for the quota window to reset when it is used up
+            delay = max(30, budget.reset_in()) if budget.exhausted() else 30
+            print(f"Restarting stream in {delay:.0f} seconds...")
+            time.sleep(delay)
+        budget.throttle()
+
+        # Fetch the latest posts again on restart so nothing posted while the stream was down is missed
+        skip_existing = False
+        health_state.stream_restarts += 1
+
+def run_worker(shard_index, shard_count):
+    """Serve the subreddits of one shard in its own process"""
+    global dead_letters, RECORD_PATH, HEALTH_PORT
+
+    subreddits = subreddits_for_shard(SUBREDDITS, shard_index, shard_count)
+    if not subreddits:
+        print(f"Shard {shard_index} has no subreddits assigned, exiting")
+        return
+
+    lease = LeaseKeeper(journal, shard_index, LEASE_SECONDS)
+    lease.acquire()
+    lease.start()
+
+    # Every worker gets an equal share of the bot's message quota
+    tg.set_rate_limit(tg.messages_per_second / shard_count)
+    # All workers use the same Reddit client and so the same request quota
+    budget.set_share(1 / shard_count)
+    dead_letters = DeadLetterQueue(f"cache/dead_letter_{shard_index}.json")
+    HEALTH_PORT = health.PORT + shard_index
+    if RECORD_PATH:
+        # One recording per worker, gzip files can not be appended to by several processes
+        folder, filename = os.path.split(RECORD_PATH)
+        RECORD_PATH = os.path.join(folder, f"shard{shard_index}_{filename}")
+
+    stream_subreddits(subreddits)
 
 def main():
     """Main function using streaming approach"""
-    stream_subreddits()
+    if SHARD_COUNT <= 1:
+        stream_subreddits()
+        return
+
+    # spawn behaves the same on every platform and gives each worker fresh handlers
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(index, SHARD_COUNT), name=f"shard-{index}")
+               for index in range(SHARD_COUNT)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,269 @@
+import glob
+import json
+import os
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+import renditions
+
+PHOTO_FILE_TYPES = ("jpg", "jpeg", "png", "webp")
+ANIMATION_FILE_TYPES = ("gif", "mp4")
+
+CORPUS_FOLDER = "corpus/extraction"
+# Target widths the golden files were recorded with, independent of config.ini.
+CORPUS_TARGETS = {"photo": 1080, "animation": 640}
+
+
+def _field(post, name: str, default=None):
+    """
+    Reads a field from a PRAW submission or from the json of a post.
+    Submissions are read through __dict__, a missing field would otherwise make PRAW
+    fetch the whole post again.
+    """
+    fields = post if isinstance(post, dict) else getattr(post, "__dict__", {})
+    value = fields.get(name, default)
+    return default if value is None else value
+
+
+def _extension(url: str) -> str:
+    path = url.lower().split("?", 1)[0]
+    return path.rsplit(".", 1)[-1] if "." in path.rsplit("/", 1)[-1] else ""
+
+
+# ------------------------Matchers------------------------------------------------------
+
+def is_gallery(post) -> bool:
+    return bool(_field(post, "gallery_data")) and bool(_field(post, "media_metadata"))
+
+
+def is_image(post) -> bool:
+    return _extension(_field(post, "url", "")) in PHOTO_FILE_TYPES
+
+
+def is_gifv(post) -> bool:
+    return _extension(_field(post, "url", "")) == "gifv"
+
+
+def is_animated_image(post) -> bool:
+    return _extension(_field(post, "url", "")) in ANIMATION_FILE_TYPES
+
+
+def is_hosted_video(post) -> bool:
+    return bool(_field(post, "is_video")) and "reddit_video" in _field(post, "media", {})
+
+
+def is_rich_embed(post) -> bool:
+    return _field(post, "post_hint") == "rich:video"
+
+
+# ------------------------Extractors----------------------------------------------------
+
+def extract_gallery(post, targets: dict) -> list:
+    media_metadata = _field(post, "media_metadata")
+    media_items = []
+    for item in _field(post, "gallery_data")["items"]:
+        metadata = media_metadata.get(item["media_id"])
+        if not metadata or metadata.get("status") != "valid":
+            continue
+        if metadata.get("e") == "Image":
+            media_item = renditions.photo_item(renditions.media_metadata_renditions(metadata), targets["photo"])
+        elif metadata.get("e") == "AnimatedImage":
+            media_item = renditions.animated_metadata_item(metadata)
+        else:
+            media_item = None
+        if media_item:
+            media_items.append(media_item)
+    return media_items
+
+
+def extract_image(post, targets: dict) -> list:
+    preview_renditions = renditions.preview_renditions(_field(post, "preview", {}), _field(post, "url"))
+    return [renditions.photo_item(preview_renditions, targets["photo"])]
+
+
+def extract_gifv(post, targets: dict) -> list:
+    # gifv is an html page on imgur, the mp4 next to it is the actual file
+    url = _field(post, "url")
+    mp4_url = url[:-len("gifv")] + "mp4"
+    preview_renditions = renditions.preview_animation_renditions(_field(post, "preview", {}), mp4_url)
+    return [renditions.animation_item(preview_renditions, targets["animation"])]
+
+
+def extract_animated_image(post, targets: dict) -> list:
+    preview_renditions = renditions.preview_animation_renditions(_field(post, "preview", {}), _field(post, "url"))
+    return [renditions.animation_item(preview_renditions, targets["animation"])]
+
+
+def extract_hosted_video(post, targets: dict) -> list:
+    return [("video", _field(post, "media")["reddit_video"]["fallback_url"], [])]
+
+
+def extract_rich_embed(post, targets: dict) -> list:
+    # Embeds (youtube, streamable, ...) can only be sent when Reddit made a video preview of them
+    video_preview = _field(post, "preview", {}).get("reddit_video_preview")
+    if not video_preview or not video_preview.get("fallback_url"):
+        return []
+    return [("video", video_preview["fallback_url"], [])]
+
+
+# Checked top to bottom, the first matching kind extracts the media of a post.
+EXTRACTORS: List[Tuple[str, Callable, Callable]] = [
+    ("gallery", is_gallery, extract_gallery),
+    ("image", is_image, extract_image),
+    ("gifv", is_gifv, extract_gifv),
+    ("animated_image", is_animated_image, extract_animated_image),
+    ("hosted_video", is_hosted_video, extract_hosted_video),
+    ("rich_embed", is_rich_embed, extract_rich_embed),
+]
+
+
+def classify(post) -> Optional[str]:
+    """
+    Returns:
+        str|None: kind of the post, None if it has no media that can be sent.
+    """
+    for kind, matches, _ in EXTRACTORS:
+        if matches(post):
+            return kind
+    return None
+
+
+def extract_media_items(post, only_images: bool = False, targets: dict = None) -> list:
+    """
+    Extracts the media of a post.
+
+    Args:
+        post: PRAW submission or the json of a post.
+        only_images(bool): keep photos only.
+        targets(dict): target width per media type, defaults to config.ini.
+
+    Returns:
+        list: (media_type, url, fallback_urls) items, empty if nothing can be sent.
+    """
+    targets = targets or {"photo": renditions.PHOTO_TARGET_WIDTH, "animation": renditions.ANIMATION_TARGET_WIDTH}
+    try:
+        for kind, matches, extract in EXTRACTORS:
+            if matches(post):
+                media_items = [item for item in extract(post, targets) if item]
+                break
+        else:
+            return []
+    except Exception as e:
+        print(f"Error collecting media items: {e}")
+        return []
+
+    if only_images:
+        media_items = [item for item in media_items if item[0] == "photo"]
+    return media_items
+
+
+# ------------------------Golden corpus and benchmark-----------------------------------
+
+def _load_corpus(folder: str) -> list:
+    cases = []
+    for path in sorted(glob.glob(os.path.join(folder, "*.json"))):
+        with open(path, "r") as datafile:
+            cases.append((os.path.basename(path), json.load(datafile)))
+    return cases
+
+
+def _as_json(media_items: list) -> list:
+    return json.loads(json.dumps(media_items))
+
+
+def check_corpus(folder: str = CORPUS_FOLDER) -> bool:
+    """
+    Compares the extraction of every post of the corpus with its golden result.
+
+    Returns:
+        bool: True if all cases match.
+    """
+    cases = _load_corpus(folder)
+    failures = 0
+    for name, case in cases:
+        kind = classify(case["post"])
+        media_items = _as_json(extract_media_items(case["post"], targets=CORPUS_TARGETS))
+        if kind != case["expected"]["kind"] or media_items != case["expected"]["media_items"]:
+            failures += 1
+            print(f"FAIL {name}\n  expected: {case['expected']}\n  got: {{'kind': {kind!r}, 'media_items': {media_items}}}")
+        else:
+            print(f"ok   {name}")
+    print(f"{len(cases) - failures}/{len(cases)} cases match")
+    return failures == 0
+
+
+def record_corpus(folder: str = CORPUS_FOLDER):
+    """
+    Rewrites the golden results of every case from the current extraction.
+    Only use after checking that the new results are correct.
+    """
+    for name, case in _load_corpus(folder):
+        case["expected"] = {
+            "kind": classify(case["post"]),
+            "media_items": _as_json(extract_media_items(case["post"], targets=CORPUS_TARGETS)),
+        }
+        with open(os.path.join(folder, name), "w") as datafile:
+            json.dump(case, datafile, indent=4)
+            datafile.write("\n")
+
+
+def import_feed(feed_path: str, folder: str = CORPUS_FOLDER, per_kind: int = 3):
+    """
+    Adds real submissions from a feed recorded by feed_replay.FeedRecorder to the corpus,
+    at most per_kind posts of every kind. The current extraction becomes their golden result,
+    so check the new files by hand before committing them.
+    """
+    from feed_replay import read_feed
+
+    counts = {}
+    for _, submission in read_feed(feed_path):
+        post = dict(vars(submission))
+        post["subreddit"] = submission.subreddit.display_name
+        post["author"] = submission.author.name if submission.author else None
+        kind = classify(post)
+        if counts.get(kind, 0) >= per_kind:
+            continue
+        path = os.path.join(folder, f"recorded_{kind or 'none'}_{post['id']}.json")
+        if os.path.exists(path):
+            continue
+        counts[kind] = counts.get(kind, 0) + 1
+        case = {
+            "description": f"Recorded {kind or 'post without media'} from r/{post['subreddit']}",
+            "post": post,
+            "expected": {
+                "kind": kind,
+                "media_items": _as_json(extract_media_items(post, targets=CORPUS_TARGETS)),
+            },
+        }
+        with open(path, "w") as datafile:
+            json.dump(case, datafile, indent=4)
+            datafile.write("\n")
+        print(f"added {path}")
+
+
+def benchmark(folder: str = CORPUS_FOLDER, rounds: int = 2000):
+    """
+    Prints the average extraction time per post for every case of the corpus.
+    """
+    for name, case in _load_corpus(folder):
+        post = case["post"]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            extract_media_items(post, targets=CORPUS_TARGETS)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<40} {elapsed / rounds * 1e6:8.2f} us/post")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if command == "check":
+        sys.exit(0 if check_corpus() else 1)
+    elif command == "record":
+        record_corpus()
+    elif command == "bench":
+        benchmark(rounds=int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    elif command == "import" and len(sys.argv) > 2:
+        import_feed(sys.argv[2])
+    else:
+        print("Usage: python media_extractor.py check|record|bench [rounds]|import <recorded feed>")
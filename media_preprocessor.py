@@ -0,0 +1,191 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+
+import requests
+
+from futures_util import when_all
+
+try:  # Pillow is optional, without it photos are passed through untouched.
+    from PIL import Image
+except ImportError:
+    Image = None
+
+config = ConfigParser()
+config.read("config.ini")
+
+ENABLED = config.getboolean("Preprocessing", "enabled", fallback=False)
+WORKERS = config.getint("Preprocessing", "workers", fallback=2)
+MEDIA_FOLDER = config.get("Preprocessing", "media_folder", fallback="cache/media")
+MAX_PHOTO_DIMENSION = config.getint("Preprocessing", "max_photo_dimension", fallback=2560)
+JPEG_QUALITY = config.getint("Preprocessing", "jpeg_quality", fallback=85)
+VIDEO_TARGET_HEIGHT = config.getint("Preprocessing", "video_target_height", fallback=720)
+
+# Telegram fetches photos of up to 5 MB and other files of up to 20 MB by URL.
+# Uploaded photos may be up to 10 MB.
+MAX_PHOTO_URL_BYTES = 5 * 1024 * 1024
+MAX_PHOTO_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_VIDEO_URL_BYTES = 20 * 1024 * 1024
+# Telegram rejects photos whose width and height add up to more than this.
+MAX_PHOTO_SIDES_SUM = 10000
+
+DASH_RENDITION = re.compile(r"DASH_(\d+)(\.mp4)?")
+DASH_HEIGHTS = [1080, 720, 480, 360, 240]
+REQUEST_TIMEOUT = 15
+
+
+def _content_length(url: str):
+    """
+    Returns:
+        int|None: size of the resource in bytes, None if it is unreachable or unknown.
+    """
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return int(response.headers.get("Content-Length", 0)) or None
+    except Exception:
+        return None
+
+
+def _local_path(url: str, extension: str) -> str:
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(MEDIA_FOLDER, f"{name}.{extension}")
+
+
+def prepare_photo(url: str) -> str:
+    """
+    Downloads a photo and, if it is too large for Telegram, downscales and re-encodes it as jpeg.
+
+    Returns:
+        str: the original url, or the path of the re-encoded file in MEDIA_FOLDER.
+    """
+    if Image is None:
+        return url
+
+    response = requests.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    data = response.content
+
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if len(data) <= MAX_PHOTO_URL_BYTES and max(width, height) <= MAX_PHOTO_DIMENSION \
+            and width + height <= MAX_PHOTO_SIDES_SUM:
+        return url
+
+    image.thumbnail((MAX_PHOTO_DIMENSION, MAX_PHOTO_DIMENSION))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    path = _local_path(url, "jpg")
+    quality = JPEG_QUALITY
+    image.save(path, "JPEG", quality=quality, optimize=True)
+    while os.path.getsize(path) > MAX_PHOTO_UPLOAD_BYTES and quality > 40:
+        quality -= 15
+        image.save(path, "JPEG", quality=quality, optimize=True)
+    return path
+
+
+def prepare_video(url: str) -> str:
+    """
+    Picks the smallest v.redd.it DASH rendition that is at least VIDEO_TARGET_HEIGHT high
+    and small enough for Telegram to fetch. Falls back to the largest one that fits.
+
+    Returns:
+        str: url of the chosen rendition, the original url if none could be checked.
+    """
+    match = DASH_RENDITION.search(url)
+    if not match:
+        return url
+
+    source_height = int(match.group(1))
+    heights = [h for h in DASH_HEIGHTS if h <= source_height]
+    candidates = []
+    for height in heights:  # Largest first
+        candidate = DASH_RENDITION.sub(f"DASH_{height}\\g<2>", url, count=1)
+        size = _content_length(candidate)
+        if size is not None and size <= MAX_VIDEO_URL_BYTES:
+            candidates.append((height, candidate))
+
+    if not candidates:
+        return url
+    adequate = [c for c in candidates if c[0] >= VIDEO_TARGET_HEIGHT]
+    return adequate[-1][1] if adequate else candidates[0][1]
+
+
+def preprocess_item(media_item):
+    """
+    Runs in a worker process. Any failure keeps the item as it is. Animations are sent
+    as extracted, gifv links are already swapped for mp4 by media_extractor.
+
+    Args:
+        media_item: (media_type, url, fallback_urls) item.
+
+    Returns:
+        list: the (media_type, url_or_path, fallback_urls) item to send.
+    """
+    media_type, url, fallback_urls = media_item
+    try:
+        if media_type == "photo":
+            url = prepare_photo(url)
+        elif media_type == "video":
+            url = prepare_video(url)
+    except Exception as e:
+        print(f"Preprocessing of {url} failed, sending it unchanged: {e}")
+    return [media_type, url, fallback_urls]
+
+
+def discard_local_files(media_items):
+    """
+    Deletes the files created by preprocessing once they are no longer needed.
+    """
+    for media_type, url, _ in media_items:
+        if url.startswith(MEDIA_FOLDER) and os.path.isfile(url):
+            os.remove(url)
+
+
+class MediaPreprocessor:
+    """
+    Prepares the media of a delivery in a process pool so the stream thread is never
+    blocked by downloads or image encoding.
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self.workers = workers
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # Created on first use, so importing the bot in a worker process does not start another pool
+        if self._pool is None:
+            os.makedirs(MEDIA_FOLDER, exist_ok=True)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def submit(self, entry: dict, callback):
+        """
+        Preprocesses all media items of a delivery and passes the updated copy of the entry
+        to callback. The original entry is passed on if preprocessing fails.
+
+        Args:
+            entry(dict): journal entry of the delivery.
+            callback(callable): receives the entry once it is ready to be sent.
+        """
+        if not entry["media_items"]:
+            callback(entry)
+            return
+
+        def on_done(futures):
+            prepared = dict(entry)
+            try:
+                prepared["media_items"] = [future.result() for future in futures]
+            except Exception as e:
+                print(f"Preprocessing of {entry['key']} failed: {e}")
+                prepared = entry
+            callback(prepared)
+
+        when_all([self.pool.submit(preprocess_item, item) for item in entry["media_items"]], on_done)
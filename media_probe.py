@@ -0,0 +1,177 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+import requests
+
+from futures_util import when_all
+
+config = ConfigParser()
+config.read("config.ini")
+
+ENABLED = config.getboolean("Probe", "enabled", fallback=True)
+WORKERS = config.getint("Probe", "workers", fallback=8)
+TIMEOUT = config.getfloat("Probe", "timeout", fallback=5)
+CACHE_TTL = config.getfloat("Probe", "cache_ttl", fallback=600)
+CACHE_SIZE = 2000
+
+# Largest file Telegram will fetch from a URL, per media type.
+URL_SIZE_LIMITS = {
+    "photo": 5 * 1024 * 1024,
+    "animation": 20 * 1024 * 1024,
+    "video": 20 * 1024 * 1024,
+}
+EXPECTED_CONTENT_TYPES = {
+    "photo": ("image/",),
+    "animation": ("image/gif", "video/"),
+    "video": ("video/",),
+}
+# Status codes that mean the file is gone for good.
+DEAD_STATUS_CODES = (401, 403, 404, 410)
+# Imgur redirects deleted images to a placeholder instead of returning 404.
+REMOVED_PLACEHOLDERS = ("i.imgur.com/removed.png",)
+
+
+class MediaProbe:
+    """
+    Checks media URLs with HEAD requests (or a one byte range GET for hosts that refuse HEAD)
+    before they are handed to Telegram, so dead media does not burn Telegram retries.
+
+    Results are cached per URL for CACHE_TTL seconds. Network errors and timeouts count as
+    reachable, only definite answers drop an item.
+    """
+
+    def __init__(self, workers: int = WORKERS, size_limits: dict = None):
+        """
+        Args:
+            workers(int): number of probes running in parallel.
+            size_limits(dict): largest accepted size in bytes per media type, a missing type is not checked.
+        """
+        self.size_limits = URL_SIZE_LIMITS if size_limits is None else size_limits
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="media-probe")
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, url: str):
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+        return None
+
+    def _store(self, url: str, result: dict):
+        with self._lock:
+            if len(self._cache) >= CACHE_SIZE:
+                now = time.monotonic()
+                self._cache = {key: value for key, value in self._cache.items() if value[0] > now}
+                if len(self._cache) >= CACHE_SIZE:
+                    self._cache.clear()
+            self._cache[url] = (time.monotonic() + CACHE_TTL, result)
+
+    @staticmethod
+    def _request(url: str) -> requests.Response:
+        response = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+        if response.status_code in (400, 405) or (response.ok and "Content-Type" not in response.headers):
+            # Host does not answer HEAD properly, ask for the first byte instead
+            response = requests.get(url, headers={"Range": "bytes=0-0"}, allow_redirects=True,
+                                    timeout=TIMEOUT, stream=True)
+            response.close()
+        return response
+
+    def probe(self, url: str) -> dict:
+        """
+        Returns:
+            dict: "reachable"(bool), "status"(int|None), "content_type"(str), "size"(int|None).
+        """
+        cached = self._cached(url)
+        if cached is not None:
+            return cached
+
+        try:
+            response = self._request(url)
+        except Exception as e:
+            # Unknown, let Telegram decide. Not cached so the next post asks again.
+            return {"reachable": True, "status": None, "content_type": "", "size": None, "error": str(e)}
+
+        size = None
+        content_range = response.headers.get("Content-Range", "")
+        if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+            size = int(content_range.rsplit("/", 1)[1])
+        elif response.status_code != 206 and response.headers.get("Content-Length", "").isdigit():
+            size = int(response.headers["Content-Length"])
+
+        result = {
+            "reachable": response.status_code not in DEAD_STATUS_CODES
+                         and not any(placeholder in response.url for placeholder in REMOVED_PLACEHOLDERS),
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "").lower(),
+            "size": size,
+        }
+        self._store(url, result)
+        return result
+
+    def is_usable(self, media_type: str, url: str) -> bool:
+        """
+        Checks reachability, content type and size of one rendition.
+        """
+        if not url.startswith("http"):
+            return True
+
+        result = self.probe(url)
+        if not result["reachable"]:
+            return False
+        content_type = result["content_type"]
+        if content_type and not content_type.startswith(EXPECTED_CONTENT_TYPES.get(media_type, ("",))):
+            return False
+        limit = self.size_limits.get(media_type)
+        if limit and result["size"] and result["size"] > limit:
+            return False
+        return True
+
+    def _usable_item(self, media_item):
+        """
+        Returns:
+            tuple|None: the item starting at its first usable rendition, None if no rendition works.
+        """
+        media_type, url, fallback_urls = media_item
+        ladder = [url, *fallback_urls]
+        for position, rendition_url in enumerate(ladder):
+            if self.is_usable(media_type, rendition_url):
+                return (media_type, rendition_url, ladder[position + 1:])
+            print(f"Dropping unusable {media_type} rendition {rendition_url}")
+        return None
+
+    def filter_items(self, media_items: list) -> list:
+        """
+        Probes all items of a post in parallel and drops the ones that are dead.
+
+        Returns:
+            list: the usable media items in their original order.
+        """
+        results = list(self._executor.map(self._usable_item, media_items))
+        return [item for item in results if item is not None]
+
+    def submit(self, media_items: list, callback):
+        """
+        Probes the items of a post in the background and passes the usable items, in their
+        original order, to callback. The caller never waits on the network.
+        """
+        if not media_items:
+            callback([])
+            return
+
+        def on_done(futures):
+            usable_items = []
+            for future, item in zip(futures, media_items):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Unknown, let Telegram decide
+                    print(f"Probing {item[1]} failed: {e}")
+                    result = item
+                if result is not None:
+                    usable_items.append(result)
+            callback(usable_items)
+
+        when_all([self._executor.submit(self._usable_item, item) for item in media_items], on_done)
@@ -0,0 +1,64 @@
+import math
+import time
+from configparser import ConfigParser
+
+config = ConfigParser()
+config.read("config.ini")
+
+# Seconds after which the freshness part of the priority has halved.
+FRESHNESS_HALF_LIFE = config.getfloat("Priority", "freshness_half_life", fallback=1800)
+# Weight of the upvote velocity (score per minute) against freshness.
+VELOCITY_WEIGHT = config.getfloat("Priority", "velocity_weight", fallback=0.5)
+# Posts older than this many seconds are dropped instead of sent. 0 disables the deadline.
+MAX_AGE = config.getfloat("Priority", "max_age", fallback=0)
+
+
+def _parse_weights(value: str) -> dict:
+    """
+    Parses "SubA:2, SubB:0.5" into {"suba": 2.0, "subb": 0.5}.
+    """
+    weights = {}
+    for pair in value.split(","):
+        if ":" in pair:
+            name, weight = pair.rsplit(":", 1)
+            weights[name.strip().lower()] = float(weight)
+    return weights
+
+
+SUBREDDIT_WEIGHTS = _parse_weights(config.get("Priority", "subreddit_weights", fallback=""))
+
+
+def post_age(entry: dict, now: float = None) -> float:
+    """
+    Returns:
+        float: seconds since the post was created, 0 if the creation time is unknown.
+    """
+    created_utc = entry.get("created_utc")
+    if not created_utc:
+        return 0.0
+    return max(0.0, (now or time.time()) - created_utc)
+
+
+def priority(entry: dict, now: float = None) -> float:
+    """
+    Priority of a delivery, higher is sent first.
+
+    Combines how fresh the post is (halving every FRESHNESS_HALF_LIFE seconds), how fast it
+    gathers upvotes and the weight of its subreddit.
+    """
+    age = post_age(entry, now)
+    freshness = 0.5 ** (age / FRESHNESS_HALF_LIFE)
+    velocity = max(entry.get("score") or 0, 0) / max(age / 60, 1)
+    weight = SUBREDDIT_WEIGHTS.get(entry["subreddit"].lower(), 1.0)
+    return weight * (freshness + VELOCITY_WEIGHT * math.log1p(velocity))
+
+
+def is_stale(entry: dict, now: float = None) -> bool:
+    """
+    Only posts that sent nothing yet can be stale, a started post is always finished so
+    no album is left half sent in the channel.
+
+    Returns:
+        bool: True if the post is past the delivery deadline.
+    """
+    return MAX_AGE > 0 and entry["sent"] == 0 and post_age(entry, now) > MAX_AGE
@@ -0,0 +1,205 @@
+import cProfile
+import functools
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from configparser import ConfigParser
+
+config = ConfigParser()
+config.read("config.ini")
+
+TIMING_ENABLED = config.getboolean("Profiling", "timing", fallback=False)
+SAMPLE_RATE = config.getfloat("Profiling", "sample_rate", fallback=1.0)
+REPORT_INTERVAL = config.getfloat("Profiling", "report_interval", fallback=300)
+CAPTURE_SECONDS = config.getfloat("Profiling", "capture_seconds", fallback=30)
+CAPTURE_ON_START = config.getboolean("Profiling", "capture_on_start", fallback=False)
+OUTPUT_FOLDER = config.get("Profiling", "output_folder", fallback="cache/profiles")
+
+# cProfile profiles every thread with one profiler from Python 3.12 on.
+SINGLE_PROFILER = sys.version_info >= (3, 12)
+# Longest time a worker thread goes without calling capture.poll().
+POLL_STEP = 1.0
+
+# Functions of main.py whose wall time is sampled, and the methods of main.cache.
+TIMED_FUNCTIONS = ("process_submission", "send_media_items")
+TIMED_CACHE_METHODS = ("is_a_repost", "save_post_id")
+
+
+class WallTimeStats:
+    """
+    Call count, total and maximum wall time per function name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            count, total, longest = self._stats.get(name, (0, 0.0, 0.0))
+            self._stats[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: {name: {"calls", "total_ms", "mean_ms", "max_ms"}} of the sampled calls.
+        """
+        with self._lock:
+            return {name: {
+                "calls": count,
+                "total_ms": round(total * 1000, 2),
+                "mean_ms": round(total / count * 1000, 2),
+                "max_ms": round(longest * 1000, 2),
+            } for name, (count, total, longest) in self._stats.items()}
+
+    def report(self):
+        print(f"{'function':<30}{'calls':>8}{'mean ms':>10}{'max ms':>10}{'total ms':>12}")
+        for name, stats in sorted(self.snapshot().items(), key=lambda item: -item[1]["total_ms"]):
+            print(f"{name:<30}{stats['calls']:>8}{stats['mean_ms']:>10}{stats['max_ms']:>10}{stats['total_ms']:>12}")
+
+
+wall_times = WallTimeStats()
+
+
+def timed(name: str):
+    """
+    Decorator that samples the wall time of a function into wall_times.
+    Only applied by install() when timing is enabled, so disabled timing costs nothing.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                wall_times.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class ProfileCapture:
+    """
+    cProfile capture of a fixed length, ended and written to OUTPUT_FOLDER by a timer.
+
+    From Python 3.12 cProfile is built on sys.monitoring and one profiler sees every thread,
+    a second one can not be enabled. Before 3.12 a profiler only sees the thread that enabled
+    it, so every worker thread calls poll() at least once a second: it starts a profiler for
+    that thread while a capture runs and writes it once the capture is over.
+    """
+
+    def __init__(self, seconds: float = CAPTURE_SECONDS):
+        self.seconds = seconds
+        self._until = 0.0
+        self._started_at = None
+        self._profile = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def running(self) -> bool:
+        return time.monotonic() < self._until
+
+    def start(self, *_):
+        """
+        Starts a capture. Usable as a signal handler. Ignored while a capture runs.
+        """
+        with self._lock:
+            if self.running():
+                return
+            self._started_at = time.strftime("%Y%m%d-%H%M%S")
+            self._until = time.monotonic() + self.seconds
+            if SINGLE_PROFILER:
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+        print(f"Profiling for {self.seconds:g} seconds")
+        timer = threading.Timer(self.seconds, self._stop)
+        timer.daemon = True
+        timer.start()
+
+    def _stop(self):
+        with self._lock:
+            profile, self._profile = self._profile, None
+        if profile is not None:
+            profile.disable()
+            self._dump(profile, "all")
+        else:
+            self.poll()  # Profile of the timer thread itself, if it has one
+
+    def _dump(self, profile: cProfile.Profile, name: str):
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        path = os.path.join(OUTPUT_FOLDER, f"{self._started_at}_{name}.prof")
+        profile.dump_stats(path)
+        print(f"Profile written to {path}")
+
+    def poll(self):
+        """
+        Starts or ends the profiler of the calling thread before Python 3.12, does nothing after.
+        """
+        if SINGLE_PROFILER:
+            return
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            if self.running():
+                self._local.profile = cProfile.Profile()
+                self._local.profile.enable()
+            return
+
+        if not self.running():
+            profile.disable()
+            self._local.profile = None
+            self._dump(profile, threading.current_thread().name)
+
+    def sleep(self, seconds: float):
+        """
+        time.sleep for worker threads that wait long, polling at least once a second.
+        """
+        deadline = time.monotonic() + seconds
+        while True:
+            self.poll()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, POLL_STEP))
+
+
+capture = ProfileCapture()
+
+
+class TimingReporter(threading.Thread):
+    def __init__(self, interval: float = REPORT_INTERVAL):
+        super().__init__(name="timing-reporter", daemon=True)
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            wall_times.report()
+
+
+def install(namespace: dict):
+    """
+    Arms the profiling hooks of the bot. Must run in the main thread.
+
+    SIGUSR1 (where the platform has it) or capture_on_start starts a cProfile capture.
+    With timing enabled, the hot functions in namespace (the globals of main.py) and the
+    methods of its cache are replaced by timed wrappers.
+    """
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, capture.start)
+    if CAPTURE_ON_START:
+        capture.start()
+
+    if not TIMING_ENABLED:
+        return
+
+    for name in TIMED_FUNCTIONS:
+        namespace[name] = timed(name)(namespace[name])
+    cache = namespace["cache"]
+    for method in TIMED_CACHE_METHODS:
+        setattr(cache, method, timed(f"cache.{method}")(getattr(cache, method)))
+    TimingReporter().start()
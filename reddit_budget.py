@@ -0,0 +1,159 @@
+import threading
+import time
+from configparser import ConfigParser
+
+config = ConfigParser()
+config.read("config.ini")
+
+# Requests kept in reserve for lazy loads and restarts, polling stops at this many.
+RESERVE = config.getint("RedditBudget", "reserve", fallback=20)
+# Length of Reddit's rate limit window, used while the reset time is unknown.
+WINDOW_SECONDS = 600
+
+
+class RedditBudget:
+    """
+    Tracks the Reddit API quota of the client from the X-Ratelimit headers and spaces out
+    requests so the remaining quota lasts until the window resets.
+
+    Every fetch path (the PRAW stream and lazy loads through the same PRAW client, see
+    attach_praw(), and the json polling of RedditHandler) reports into the same instance
+    and waits in throttle().
+    """
+
+    def __init__(self, reserve: int = RESERVE):
+        self.reserve = reserve
+        self.share = 1.0
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._used = None
+        self._reset_at = None
+        self._responses = 0
+        self._last_request_at = 0.0
+        self.window = WINDOW_SECONDS
+
+    def set_share(self, share: float):
+        """
+        Part of the quota this process may use, for workers that share one Reddit client.
+        """
+        self.share = share
+
+    def update(self, remaining, used=None, reset_in=None):
+        """
+        Args:
+            remaining(float): requests left in the current window.
+            used(int): requests used in the current window.
+            reset_in(float): seconds until the window resets.
+        """
+        if remaining is None:
+            return
+        with self._lock:
+            self._remaining = float(remaining)
+            self._used = None if used is None else int(used)
+            self._reset_at = None if reset_in is None else time.time() + float(reset_in)
+            self._responses += 1
+
+    def update_from_headers(self, headers):
+        """
+        Reads the X-Ratelimit-Remaining/Used/Reset headers of a Reddit response.
+        A response without them counts as one request, the way PRAW counts it.
+        """
+        remaining = headers.get("X-Ratelimit-Remaining")
+        if remaining is None:
+            with self._lock:
+                if self._remaining is not None:
+                    self._remaining -= 1
+                    self._used = None if self._used is None else self._used + 1
+                self._responses += 1
+            return
+        self.update(remaining, headers.get("X-Ratelimit-Used"), headers.get("X-Ratelimit-Reset"))
+
+    def attach_praw(self, reddit):
+        """
+        Feeds the headers of every response a PRAW client receives into the budget. PRAW
+        itself only exposes remaining and used (reddit.auth.limits), not the reset time, so
+        the update of its rate limiter is wrapped. Relies on the prawcore pinned in requirements.txt.
+        """
+        self.window = reddit.config.window_size or self.window
+        sessions = {id(core): core for core in (reddit._read_only_core, reddit._authorized_core) if core}
+        for core in sessions.values():
+            rate_limiter = core.rate_limiter
+            update = rate_limiter.update
+
+            def update_and_record(*, response_headers, update=update):
+                update(response_headers=response_headers)
+                self.update_from_headers(response_headers)
+
+            rate_limiter.update = update_and_record
+
+    def new_responses(self) -> int:
+        """
+        Returns:
+            int: responses recorded since the last call.
+        """
+        with self._lock:
+            responses, self._responses = self._responses, 0
+        return responses
+
+    def _reset_in(self) -> float:
+        # Without a reset time the whole window is assumed to be ahead, the safe side
+        if self._reset_at is None:
+            return self.window
+        return max(0.0, self._reset_at - time.time())
+
+    def reset_in(self) -> float:
+        with self._lock:
+            return self._reset_in() if self._remaining is not None else 0.0
+
+    def exhausted(self) -> bool:
+        with self._lock:
+            return self._remaining is not None and self._remaining <= self.reserve and self._reset_in() > 0
+
+    def pace(self) -> float:
+        """
+        Returns:
+            float: seconds that should lie between two requests so the quota share lasts
+                   until the reset. Grows as the remaining quota shrinks.
+        """
+        with self._lock:
+            if self._remaining is None:
+                return 0.0
+            reset_in = self._reset_in()
+            usable = (self._remaining - self.reserve) * self.share
+        if reset_in == 0:
+            return 0.0
+        if usable < 1:
+            return reset_in
+        return reset_in / usable
+
+    def throttle(self):
+        """
+        Blocks until the next request fits into the budget.
+        """
+        pace = self.pace()
+        with self._lock:
+            now = time.monotonic()
+            wait = self._last_request_at + pace - now
+            self._last_request_at = max(now, self._last_request_at + pace)
+        if wait > 0:
+            if wait > 5:
+                print(f"Reddit quota low, waiting {wait:.0f} seconds")
+            time.sleep(wait)
+
+    def headroom(self) -> dict:
+        """
+        Returns:
+            dict: remaining and used requests, seconds until reset and the current pace.
+        """
+        with self._lock:
+            remaining, used = self._remaining, self._used
+        return {
+            "remaining": remaining,
+            "used": used,
+            "reset_in_seconds": round(self.reset_in()),
+            "pace_seconds": round(self.pace(), 2),
+        }
+
+
+# Shared by every fetch path of the process
+budget = RedditBudget()
@@ -6,6 +6,9 @@ import requests
 import random
 from cache import Cache
 from input_object import InputObject
+from media_extractor import extract_media_items, is_gallery
+from reddit_budget import budget
+from caption import renderer as caption_renderer
 from datetime import datetime, timezone
 
 HEADER = {
@@ -24,11 +27,6 @@ SEARCH_LIMIT = config["Reddit"]["search_limit"]
 SORT = config["Reddit"]["sort_posts"]
 FETCH_LATEST = eval(config["Reddit"]["fetch_latest_post"])
 
-CHANNEL_NAME = config["Telegram"]["channel_name"]
-CHANNEL_LINK = config["Telegram"]["channel_link"]
-INCLUDE_TITLE = eval(config["Telegram"]["include_title"])
-LINK_TO_POST = eval(config["Telegram"]["link_to_post"])
-SIGN_MESSAGES = eval(config["Telegram"]["sign_messages"])
 ONLY_IMAGES = eval(config["Telegram"]["only_images"])
 
 PHOTO_FILE_TYPES = ["jpg", "jpeg", "png", "webp"]
@@ -47,11 +45,19 @@ class RedditHandler:
             client_secret=config["Reddit"]["client_secret"],
             user_agent="script:RedditToTelegramBot:v1.0 (by /u/YourUsername)"
         )
+        # Every response of the client counts against the shared request budget
+        budget.attach_praw(self.reddit)
 
-    def get_submission_stream(self):
-        """Get a stream of new submissions from all configured subreddits"""
-        subreddits = "+".join(SUBREDDIT_LIST)
-        return self.reddit.subreddit(subreddits).stream.submissions(skip_existing=True)
+    def get_submission_stream(self, subreddit_list=None, skip_existing=True, pause_after=None):
+        """
+        Get a stream of new submissions from the given subreddits, all configured ones by default.
+
+        skip_existing=False first yields the latest posts again (backfill after a restart).
+        With pause_after set, None is yielded when a poll returned nothing new.
+        """
+        subreddits = "+".join(subreddit_list or SUBREDDIT_LIST)
+        return self.reddit.subreddit(subreddits).stream.submissions(skip_existing=skip_existing,
+                                                                      pause_after=pause_after)
 
     def format_post_metadata(self, submission):
         """Format post metadata including timestamp and user info"""
@@ -66,128 +72,14 @@ class RedditHandler:
         
         return "\n".join(metadata)
 
-    def process_submission(self, submission):
-        """Process a submission from the stream"""
-        try:
-            # Skip removed or stickied posts
-            if hasattr(submission, 'removed_by_category') and submission.removed_by_category:
-                return None
-            if submission.stickied:
-                return None
-
-            # Set current subreddit and post ID
-            self.currrent_subreddit = submission.subreddit.display_name
-            self.post_id = submission.id
-
-            # Create post_json from submission
-            self.post_json = {
-                "id": submission.id,
-                "removed_by_category": getattr(submission, 'removed_by_category', None),
-                "stickied": submission.stickied,
-                "permalink": submission.permalink,
-                "title": submission.title,
-                "subreddit": submission.subreddit.display_name,
-                "link_flair_text": submission.link_flair_text,
-                "url_overridden_by_dest": submission.url,
-                "is_gallery": hasattr(submission, 'gallery_data'),
-                "is_video": submission.is_video,
-                "media": submission.media,
-                "post_hint": getattr(submission, 'post_hint', None),
-                "preview": getattr(submission, 'preview', {})
-            }
-
-            if hasattr(submission, 'media_metadata'):
-                self.post_json["media_metadata"] = submission.media_metadata
-
-            # Format post title with metadata
-            post_title = ""
-            if INCLUDE_TITLE:
-                post_title += submission.title + "\n"
-          
-            if LINK_TO_POST:
-                current_reddit_url = f'www.reddit.com{submission.permalink}'
-                post_title += f'<a href="{current_reddit_url}">r/{submission.subreddit.display_name}</a>\n'
-         
-            if SIGN_MESSAGES:
-                post_title += f'<a href="{CHANNEL_LINK}">-{CHANNEL_NAME}</a>'
-
-
-            # Check post types
-            if not ONLY_IMAGES:
-                if self.is_photo_post():
-                    return ("photo", submission.url, post_title, submission.link_flair_text)
-
-                elif self.is_gallery_post():
-                    gallery_data = self.process_gallery(submission)
-                    if gallery_data:
-                        return ("gallery", gallery_data[0], gallery_data[1], post_title, submission.link_flair_text)
-
-                elif self.is_animation_post():
-                    return ("animation", submission.url, post_title, submission.link_flair_text)
-
-                elif self.is_video_post():
-                    if submission.media and 'reddit_video' in submission.media:
-                        video_url = submission.media['reddit_video']['fallback_url']
-                        video_id = video_url.rsplit("/", 1)[1]
-                        video_height = submission.media['reddit_video']['height']
-                        return ("video", video_id, video_height, post_title, submission.link_flair_text)
-
-                elif self.is_gfycat_post():
-                    if submission.media and 'oembed' in submission.media:
-                        preview_url = submission.media['oembed']['thumbnail_url']
-                        gfycat_id = preview_url.split("/")[-1].split("-")[-2]
-                        return ("gfycat", gfycat_id, post_title, submission.link_flair_text)
-
-            else:  # Photo posts only
-                if self.is_photo_post():
-                    return ("photo", submission.url, post_title, submission.link_flair_text)
-
-            return None
-
-        except Exception as e:
-            print(f"Error processing submission: {e}")
-            return None
-
-    def collect_media_from_submission(self, submission) -> List[Tuple[str, str]]:
+    def collect_media_from_submission(self, submission) -> List[Tuple[str, str, List[str]]]:
         """
         Collect all media items from a submission
         
         Returns:
-            List of tuples containing (media_type, media_url)
+            List of tuples containing (media_type, media_url, fallback_urls)
         """
-        media_items = []
-        
-        # Handle gallery posts
-        if hasattr(submission, 'gallery_data') and hasattr(submission, 'media_metadata'):
-            for item in submission.gallery_data['items']:
-                media_id = item['media_id']
-                if media_id in submission.media_metadata:
-                    media = submission.media_metadata[media_id]
-                    if media['status'] == 'valid':
-                        if media['e'] == 'Image':
-                            url = media['s']['u'].replace("amp;", "")
-                            media_items.append(("photo", url))
-                        elif media['e'] == 'AnimatedImage':
-                            url = media['s']['gif']
-                            media_items.append(("animation", url))
-                            
-        # Handle single image posts
-        elif self.is_photo_post():
-            url = self.post_json["url_overridden_by_dest"]
-            media_items.append(("photo", url))
-            
-        # Handle video posts
-        elif self.is_video_post():
-            if self.post_json["media"] and 'reddit_video' in self.post_json["media"]:
-                video_url = self.post_json["media"]["reddit_video"]["fallback_url"]
-                media_items.append(("video", video_url))
-                
-        # Handle animation posts
-        elif self.is_animation_post():
-            url = self.post_json["url_overridden_by_dest"]
-            media_items.append(("animation", url))
-            
-        return media_items
+        return extract_media_items(submission, only_images=ONLY_IMAGES)
 
     def process_submission(self, submission):
         """Process a submission and collect all media items"""
@@ -243,60 +135,31 @@ class RedditHandler:
 
     def format_post_title(self, submission):
         """Format the post title with additional information"""
-        post_title = ""
-        
-        if config.getboolean("Telegram", "include_title", fallback=True):
-            post_title += submission.title + "\n"
-            
-        if config.getboolean("Telegram", "link_to_post", fallback=True):
-            current_reddit_url = f'www.reddit.com{submission.permalink}'
-            post_title += f'<a href="{current_reddit_url}">r/{submission.subreddit.display_name}</a>\n'
-            
-        if config.getboolean("Telegram", "sign_messages", fallback=True):
-            channel_link = config["Telegram"]["channel_link"]
-            channel_name = config["Telegram"]["channel_name"]
-            post_title += f'<a href="{channel_link}">-{channel_name}</a>'
-            
-        return post_title
+        return caption_renderer.render_submission(submission)
 
     def process_gallery(self, submission):
         """Process gallery submissions"""
         try:
-            if not hasattr(submission, 'gallery_data') or not hasattr(submission, 'media_metadata'):
+            if not is_gallery(submission):
                 return None
 
+            post_title = self.format_post_title(submission)
             gallery_photos = []
             gallery_animations = []
-        
-            # Format caption (only for first image)
-            post_title = ""
-            if INCLUDE_TITLE:
-                post_title += submission.title + "\n"
-            if LINK_TO_POST:
-                post_title += f'<a href="https://www.reddit.com{submission.permalink}">r/{submission.subreddit.display_name}</a>\n'
-            if SIGN_MESSAGES:
-                post_title += f'<a href="{CHANNEL_LINK}">-{CHANNEL_NAME}</a>'
-
-            # Process all media items
-            for item in submission.gallery_data['items']:
-                if item['media_id'] in submission.media_metadata:
-                    media = submission.media_metadata[item['media_id']]
-                    if media["status"] == "valid":
-                        if media["e"] == "Image":
-                            url = media["s"]["u"].replace("amp;", "")
-                            # Create media group object for photos
-                            media_obj = InputObject(
-                                media=url,
-                                type="photo",
-                                # Only add caption to first photo in group
-                                caption=post_title if len(gallery_photos) == 0 else "",
-                                subreddit=submission.subreddit.display_name,
-                                reddit_url=f'https://www.reddit.com{submission.permalink}'
-                            )
-                            gallery_photos.append(media_obj.__dict__)
-                        elif media["e"] == "AnimatedImage":
-                            url = media["s"]["gif"]
-                            gallery_animations.append(url)
+
+            for media_type, url, _ in extract_media_items(submission):
+                if media_type == "photo":
+                    media_obj = InputObject(
+                        media=url,
+                        type="photo",
+                        # Only add caption to first photo in group
+                        caption=post_title if len(gallery_photos) == 0 else "",
+                        subreddit=submission.subreddit.display_name,
+                        reddit_url=f'https://www.reddit.com{submission.permalink}'
+                    )
+                    gallery_photos.append(media_obj.__dict__)
+                else:
+                    gallery_animations.append(url)
 
             if gallery_photos or gallery_animations:
                 return ("gallery", gallery_photos, gallery_animations, post_title, submission.link_flair_text)
@@ -393,8 +256,10 @@ class RedditHandler:
 
         request_url = REDDIT_URL + self.currrent_subreddit + f"/{SORT}/" + ".json"
 
+        budget.throttle()
         try:
             reddit_response = requests.get(request_url, params=REDDIT_PARAMETER, headers=HEADER)
+            budget.update_from_headers(reddit_response.headers)
             reddit_response.raise_for_status()
         except:
             print("too many requests")
@@ -473,23 +338,11 @@ class RedditHandler:
             current_permalink = self.post_json["permalink"]
             current_reddit_url = f'www.reddit.com{current_permalink}'
 
-            current_title = self.post_json["title"]
             current_subreddit = self.post_json["subreddit"]
             post_flair = self.post_json.get("link_flair_text", "")
 
-            post_title = ""
-
             # ----------Post Caption and Signature-------------------------------
-            if INCLUDE_TITLE:
-                post_title = post_title + current_title + "\n"
-
-            if LINK_TO_POST:
-                hyperlink = f'<a href="{current_reddit_url}">r/{current_subreddit}</a>\n\n'
-                post_title = post_title + hyperlink
-
-            if SIGN_MESSAGES:
-                post_signature = f'<a href="{CHANNEL_LINK}">-{CHANNEL_NAME}</a>'
-                post_title = post_title + post_signature
+            post_title = caption_renderer.render(self.post_json["title"], current_permalink, current_subreddit)
 
             # ------------Checking the type of post fetched--------------------
 
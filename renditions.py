@@ -0,0 +1,133 @@
+from configparser import ConfigParser
+from typing import List, Tuple
+
+config = ConfigParser()
+config.read("config.ini")
+
+# Width in pixels a rendition should have at least. 0 always uses the source.
+PHOTO_TARGET_WIDTH = config.getint("Media", "photo_target_width", fallback=1080)
+ANIMATION_TARGET_WIDTH = config.getint("Media", "animation_target_width", fallback=640)
+
+
+def _clean(url: str) -> str:
+    return url.replace("amp;", "")
+
+
+def ladder(renditions: List[Tuple[int, str]], target_width: int) -> List[str]:
+    """
+    Orders the renditions of one media item for sending.
+
+    Args:
+        renditions(list): (width, url) pairs in any order, the source included.
+        target_width(int): smallest acceptable width.
+
+    Returns:
+        list: urls starting with the smallest rendition at least target_width wide,
+              followed by every larger one up to the source. Renditions of the same
+              width keep their given order. If no rendition is wide enough, only the
+              widest ones are returned. A target_width of 0 returns only the source.
+    """
+    unique = {}
+    for width, url in renditions:
+        if url:
+            unique[_clean(url)] = width or 0
+    ordered = sorted(unique.items(), key=lambda rendition: rendition[1])
+    if not ordered:
+        return []
+
+    if target_width <= 0:
+        # The source, which comes last among the widest renditions
+        return [ordered[-1][0]]
+
+    target_width = min(target_width, ordered[-1][1])
+    for index, (url, width) in enumerate(ordered):
+        if width >= target_width:
+            return [url for url, _ in ordered[index:]]
+
+
+def media_metadata_renditions(metadata: dict) -> List[Tuple[int, str]]:
+    """
+    Returns:
+        list: (width, url) pairs of a gallery image from its "p" previews and "s" source.
+    """
+    renditions = [(preview.get("x", 0), preview.get("u")) for preview in metadata.get("p", [])]
+    source = metadata.get("s", {})
+    renditions.append((source.get("x", 0), source.get("u")))
+    return renditions
+
+
+def _preview_image(preview: dict) -> dict:
+    try:
+        return preview["images"][0]
+    except (KeyError, IndexError, TypeError):
+        return {}
+
+
+def _resolution_renditions(image: dict, source_url: str = None) -> List[Tuple[int, str]]:
+    renditions = [(resolution.get("width", 0), resolution.get("url")) for resolution in image.get("resolutions", [])]
+    source = image.get("source", {})
+    source_width = source.get("width", 0)
+    renditions.append((source_width, source.get("url")))
+
+    if source_url:
+        # The linked file has the size of the preview source but is not re-encoded, so it comes last
+        renditions.append((source_width, source_url))
+    return renditions
+
+
+def preview_renditions(preview: dict, source_url: str = None) -> List[Tuple[int, str]]:
+    """
+    Returns:
+        list: (width, url) pairs from the "preview" of an image link post, with the
+              linked file added as the last rendition.
+    """
+    return _resolution_renditions(_preview_image(preview), source_url)
+
+
+def preview_animation_renditions(preview: dict, source_url: str = None) -> List[Tuple[int, str]]:
+    """
+    Returns:
+        list: (width, url) pairs of the mp4 variants Reddit renders for gif link posts,
+              with the linked file added as the last rendition.
+    """
+    mp4_variant = _preview_image(preview).get("variants", {}).get("mp4", {})
+    if not mp4_variant:
+        return [(0, source_url)] if source_url else []
+    return _resolution_renditions(mp4_variant, source_url)
+
+
+def photo_item(renditions: List[Tuple[int, str]], target_width: int = PHOTO_TARGET_WIDTH):
+    """
+    Returns:
+        tuple|None: ('photo', url, fallback_urls) media item for the best rendition.
+    """
+    urls = ladder(renditions, target_width)
+    if not urls:
+        return None
+    return ("photo", urls[0], urls[1:])
+
+
+def animation_item(renditions: List[Tuple[int, str]], target_width: int = ANIMATION_TARGET_WIDTH):
+    """
+    Returns:
+        tuple|None: ('animation', url, fallback_urls) media item for the best rendition.
+    """
+    urls = ladder(renditions, target_width)
+    if not urls:
+        return None
+    return ("animation", urls[0], urls[1:])
+
+
+def animated_metadata_item(metadata: dict):
+    """
+    Gallery animations come as mp4 and gif of the same size. The mp4 is much smaller,
+    the gif is kept as fallback.
+
+    Returns:
+        tuple|None: ('animation', url, fallback_urls) media item.
+    """
+    source = metadata.get("s", {})
+    urls = [_clean(source[key]) for key in ("mp4", "gif") if source.get(key)]
+    if not urls:
+        return None
+    return ("animation", urls[0], urls[1:])
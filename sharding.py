@@ -0,0 +1,59 @@
+import os
+import socket
+import threading
+import time
+import zlib
+from typing import List
+
+from shared_store import SharedStore
+
+
+def shard_for(subreddit: str, shard_count: int) -> int:
+    """
+    Maps a subreddit to a shard. crc32 is used instead of hash() because it is stable
+    across processes and interpreter runs.
+    """
+    return zlib.crc32(subreddit.lower().encode("utf-8")) % shard_count
+
+
+def subreddits_for_shard(subreddits: List[str], shard_index: int, shard_count: int) -> List[str]:
+    """
+    Returns:
+        list: the subreddits served by shard_index.
+    """
+    return [s for s in subreddits if shard_for(s, shard_count) == shard_index]
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Holds the lease of a shard in the shared store and renews it in the background.
+    The process exits if the lease is lost, so a shard is never served twice.
+    """
+
+    def __init__(self, store: SharedStore, shard_index: int, lease_seconds: float):
+        super().__init__(name=f"lease-keeper-{shard_index}", daemon=True)
+        self.store = store
+        self.shard_index = shard_index
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def acquire(self):
+        """
+        Blocks until the lease of the shard is free.
+        """
+        while not self.store.acquire_lease(self.shard_index, self.owner, self.lease_seconds):
+            print(f"Shard {self.shard_index} is leased by another process, waiting...")
+            time.sleep(self.lease_seconds / 3)
+        print(f"Acquired lease for shard {self.shard_index} as {self.owner}")
+
+    def run(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                renewed = self.store.acquire_lease(self.shard_index, self.owner, self.lease_seconds)
+            except Exception as e:
+                print(f"Failed to renew lease of shard {self.shard_index}: {e}")
+                continue
+            if not renewed:
+                print(f"Lost lease of shard {self.shard_index}, stopping worker")
+                os._exit(1)
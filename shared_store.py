@@ -0,0 +1,184 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class SharedStore:
+    """
+    SQLite backed replacement for Cache and DeliveryJournal that can be shared by several
+    bot processes. The database runs in WAL mode so readers never block the writer and
+    concurrent writers are serialised by SQLite's own locking.
+
+    It also keeps the shard leases that stop two processes from serving the same shard.
+    """
+
+    PENDING = "pending"
+    PARTIAL = "partial"
+
+    def __init__(self, path: str = "cache/shared_store.db"):
+        self.path = path
+        self._local = threading.local()
+        self._execute_script("""
+            CREATE TABLE IF NOT EXISTS posts (
+                subreddit TEXT NOT NULL,
+                post_id TEXT NOT NULL,
+                PRIMARY KEY (subreddit, post_id)
+            );
+            CREATE TABLE IF NOT EXISTS journal (
+                key TEXT PRIMARY KEY,
+                subreddit TEXT NOT NULL,
+                post_id TEXT NOT NULL,
+                media_items TEXT NOT NULL,
+                caption TEXT NOT NULL,
+                state TEXT NOT NULL,
+                sent INTEGER NOT NULL,
+                created_utc REAL,
+                score INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                shard INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+        self._add_missing_columns()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread, opened lazily so the store can be created before a fork.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _execute_script(self, script: str):
+        self._connection.executescript(script)
+
+    def _add_missing_columns(self):
+        """
+        Upgrades journal tables created before posts were scheduled by age and score.
+        """
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(journal)")}
+        if "created_utc" not in columns:
+            self._connection.execute("ALTER TABLE journal ADD COLUMN created_utc REAL")
+        if "score" not in columns:
+            self._connection.execute("ALTER TABLE journal ADD COLUMN score INTEGER NOT NULL DEFAULT 0")
+
+    @staticmethod
+    def _key(subreddit: str, post_id: str) -> str:
+        return f"{subreddit.lower()}/{post_id}"
+
+    # ------------------------Deduplication (same interface as Cache)----------------------
+
+    def is_a_repost(self, subreddit: str, post_id: str) -> bool:
+        """
+        Checks if the fetched post has been sent as a message before by any process.
+        """
+        row = self._connection.execute(
+            "SELECT 1 FROM posts WHERE subreddit = ? AND post_id = ?", (subreddit.lower(), post_id)
+        ).fetchone()
+        return row is not None
+
+    def save_post_id(self, subreddit: str, post_id: str):
+        """
+        Stores the post id to prevent reposts.
+        """
+        self._connection.execute(
+            "INSERT OR IGNORE INTO posts (subreddit, post_id) VALUES (?, ?)", (subreddit.lower(), post_id)
+        )
+
+    # ------------------------Delivery journal (same interface as DeliveryJournal)---------
+
+    def is_open(self, subreddit: str, post_id: str) -> bool:
+        row = self._connection.execute(
+            "SELECT 1 FROM journal WHERE key = ?", (self._key(subreddit, post_id),)
+        ).fetchone()
+        return row is not None
+
+    def begin(self, subreddit: str, post_id: str, media_items: list, caption: str,
+              created_utc: float = None, score: int = 0) -> dict:
+        entry = {
+            "key": self._key(subreddit, post_id),
+            "state": self.PENDING,
+            "subreddit": subreddit,
+            "post_id": post_id,
+            "media_items": [list(item) for item in media_items],
+            "caption": caption,
+            "sent": 0,
+            "created_utc": created_utc,
+            "score": score,
+        }
+        self._connection.execute(
+            "INSERT OR REPLACE INTO journal "
+            "(key, subreddit, post_id, media_items, caption, state, sent, created_utc, score) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry["key"], subreddit, post_id, json.dumps(entry["media_items"]), caption, self.PENDING, 0,
+             created_utc, score),
+        )
+        return entry
+
+    def mark_partial(self, subreddit: str, post_id: str, item_index: int):
+        self._connection.execute(
+            "UPDATE journal SET state = ?, sent = ? WHERE key = ?",
+            (self.PARTIAL, item_index + 1, self._key(subreddit, post_id)),
+        )
+
+    def mark_done(self, subreddit: str, post_id: str):
+        self._connection.execute("DELETE FROM journal WHERE key = ?", (self._key(subreddit, post_id),))
+
+    def unfinished(self) -> list:
+        rows = self._connection.execute(
+            "SELECT key, state, subreddit, post_id, media_items, caption, sent, created_utc, score FROM journal"
+        ).fetchall()
+        return [{
+            "key": key,
+            "state": state,
+            "subreddit": subreddit,
+            "post_id": post_id,
+            "media_items": json.loads(media_items),
+            "caption": caption,
+            "sent": sent,
+            "created_utc": created_utc,
+            "score": score,
+        } for key, state, subreddit, post_id, media_items, caption, sent, created_utc, score in rows]
+
+    # ------------------------Shard leases-----------------------------------------------
+
+    def acquire_lease(self, shard: int, owner: str, lease_seconds: float) -> bool:
+        """
+        Takes or renews the lease of a shard.
+
+        Args:
+            shard(int): index of the shard.
+            owner(str): unique name of the process asking for the lease.
+            lease_seconds(float): how long the lease stays valid without renewal.
+
+        Returns:
+            bool: True if owner holds the lease afterwards.
+        """
+        now = time.time()
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT owner, expires_at FROM leases WHERE shard = ?", (shard,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO leases (shard, owner, expires_at) VALUES (?, ?, ?)",
+                (shard, owner, now + lease_seconds),
+            )
+            connection.execute("COMMIT")
+            return True
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def release_lease(self, shard: int, owner: str):
+        self._connection.execute("DELETE FROM leases WHERE shard = ? AND owner = ?", (shard, owner))
@@ -1,37 +1,210 @@
+import json
+import os
 import time
+import threading
 import requests
+from collections import OrderedDict
 from configparser import ConfigParser
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Callable, Optional
 
 config = ConfigParser()
 config.read("config.ini")
 
+# file_ids remembered per token, oldest are forgotten first
+FILE_ID_CACHE_SIZE = 2000
+
+
+class BotToken:
+    """
+    One bot of the pool with its own rate limit, cooldown after a 429 and the file_ids
+    Telegram returned to it. A file_id can only be used by the bot that received it.
+    """
+
+    def __init__(self, index: int, token: str, api_url: str):
+        self.name = f"bot {index}"  # The token itself is a secret and never printed
+        self.base_url = f'{api_url}/bot{token}'
+        self.next_request_at = 0.0
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self.file_ids = OrderedDict()
+
+    def usable(self, now: float) -> bool:
+        return not self.disabled and self.cooldown_until <= now
+
+    def remember_file_id(self, media: str, file_id: str) -> None:
+        self.file_ids[media] = file_id
+        self.file_ids.move_to_end(media)
+        if len(self.file_ids) > FILE_ID_CACHE_SIZE:
+            self.file_ids.popitem(last=False)
+
+
 class TelegramHandler:
-    def __init__(self, chat_id):
+    def __init__(self, chat_id, api_url=None):
         self.chat_id = chat_id
-        self.api_token = config["Telegram"]["bot_api_key"]
         self.enable_notification = eval(config["Telegram"]["enable_notification"])
         
-        # API URLs
-        self.base_url = f'https://api.telegram.org/bot{self.api_token}'
-        self.photo_url = f'{self.base_url}/sendPhoto'
-        self.media_group_url = f'{self.base_url}/sendMediaGroup'
-        self.action_url = f'{self.base_url}/sendChatAction'
-        self.video_url = f'{self.base_url}/sendVideo'
-        self.animation_url = f'{self.base_url}/sendAnimation'
+        # API URLs. api_url can point to a local Bot API server or a stub for replays.
+        self.api_url = api_url or config.get("Telegram", "api_url", fallback="https://api.telegram.org")
+
+        # Pool of bots that are all admins of the channel, sends are spread over them
+        api_tokens = [token.strip() for token in config.get("Telegram", "bot_api_keys", fallback="").split(",")
+                      if token.strip()] or [config["Telegram"]["bot_api_key"]]
+        self.tokens = [BotToken(index, token, self.api_url) for index, token in enumerate(api_tokens)]
         
         # Constants
         self.MAX_RETRIES = 2
         self.MEDIA_GROUP_LIMIT = 10
         self.parse_mode = "HTML"
 
+        # Description of the most recent failed request, used for dead letters.
+        # Kept per thread, the delivery, dead letter and digest threads send at the same time.
+        self._local = threading.local()
+
+        # Client side rate limit per bot, spaces out requests to stay inside each bot's quota
+        self.messages_per_second = config.getfloat("Telegram", "bot_messages_per_second", fallback=30)
+        self._rate_lock = threading.Lock()
+        self.set_rate_limit(self.messages_per_second)
+
+    @property
+    def last_error(self) -> Optional[str]:
+        """Most recent failure of a request made by the current thread"""
+        return getattr(self._local, "last_error", None)
+
+    @last_error.setter
+    def last_error(self, error: Optional[str]) -> None:
+        self._local.last_error = error
+
+    def set_rate_limit(self, messages_per_second: float) -> None:
+        """Limit the number of requests each bot of the pool makes per second"""
+        self.min_interval = 1 / messages_per_second if messages_per_second > 0 else 0
+
+    def _acquire_token(self) -> Optional[BotToken]:
+        """
+        Pick the usable bot that is allowed to send the soonest and wait for its rate limit.
+        While every bot is cooling down after a 429 this waits for the first one to recover.
+
+        Returns:
+            BotToken|None: None if every bot of the pool was rejected by Telegram.
+        """
+        while True:
+            with self._rate_lock:
+                now = time.monotonic()
+                usable = [token for token in self.tokens if token.usable(now)]
+                if usable:
+                    token = min(usable, key=lambda token: token.next_request_at)
+                    wait = token.next_request_at - now
+                    token.next_request_at = max(now, token.next_request_at) + self.min_interval
+                else:
+                    cooling = [token.cooldown_until for token in self.tokens if not token.disabled]
+                    if not cooling:
+                        return None
+                    token, wait = None, min(cooling) - now
+            if wait > 0:
+                time.sleep(wait)
+            if token:
+                return token
+
+    def _request(self, method: str, build: Callable[[BotToken], Dict[str, Any]],
+                 on_result: Callable[[BotToken, Any], None] = None) -> Any:
+        """
+        Send a Bot API request through the pool. A bot answering 429 cools down for the
+        retry_after Telegram asks for, a bot answering 401 is taken out of the pool; in both
+        cases the request moves on to the next bot.
+
+        Args:
+            method(str): Bot API method.
+            build(callable): returns the requests.post keyword arguments for the chosen bot,
+                             so file_ids of that bot can be used.
+            on_result(callable): called with the bot and the result of a successful request.
+
+        Returns:
+            The result field of Telegram's answer.
+        """
+        for _ in range(2 * len(self.tokens)):
+            token = self._acquire_token()
+            if token is None:
+                break
+
+            request = build(token)
+            try:
+                response = requests.post(f'{token.base_url}/{method}', **request)
+            finally:
+                # Uploads are opened again by build() for every bot that is tried
+                for file in (request.get("files") or {}).values():
+                    file.close()
+            if response.status_code == 429:
+                try:
+                    retry_after = response.json()["parameters"]["retry_after"]
+                except (ValueError, KeyError):
+                    retry_after = 5
+                token.cooldown_until = time.monotonic() + retry_after
+                print(f"{token.name} is rate limited for {retry_after} seconds")
+                continue
+            if response.status_code == 401:
+                token.disabled = True
+                print(f"{token.name} was rejected by Telegram (401) and is removed from the pool")
+                continue
+
+            response.raise_for_status()
+            result = response.json().get("result")
+            if on_result:
+                on_result(token, result)
+            return result
+        raise RuntimeError("No bot of the pool could send the request")
+
+    def pool_status(self) -> List[Dict[str, Any]]:
+        """State of every bot of the pool, for the health report"""
+        now = time.monotonic()
+        return [{
+            "name": token.name,
+            "disabled": token.disabled,
+            "cooldown_seconds": round(max(0.0, token.cooldown_until - now)),
+            "file_ids": len(token.file_ids),
+        } for token in self.tokens]
+
+    @staticmethod
+    def _file_id(message: Dict[str, Any]) -> Optional[str]:
+        """Returns the file_id of the media in a sent message"""
+        if not isinstance(message, dict):
+            return None
+        if message.get("photo"):
+            return message["photo"][-1]["file_id"]  # Largest size
+        for field in ("video", "animation", "document"):
+            if isinstance(message.get(field), dict):
+                return message[field]["file_id"]
+        return None
+
+    def _remember(self, media: List[str]) -> Callable[[BotToken, Any], None]:
+        """Remember the file_ids of the sent media for the bot that sent them"""
+        def on_result(token: BotToken, result: Any) -> None:
+            messages = result if isinstance(result, list) else [result]
+            for media_ref, message in zip(media, messages):
+                file_id = self._file_id(message)
+                if file_id and file_id != media_ref:
+                    token.remember_file_id(media_ref, file_id)
+        return on_result
+
+    @staticmethod
+    def _media_payload(token: BotToken, field: str, media: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Split a media reference into request params and files.
+        Media the bot sent before is referenced by its file_id, URLs are passed to Telegram
+        to fetch and local files (from preprocessing) are uploaded.
+        """
+        file_id = token.file_ids.get(media)
+        if file_id:
+            return {field: file_id}, {}
+        if os.path.isfile(media):
+            return {}, {field: open(media, "rb")}
+        return {field: media}, {}
+
     def _send_chat_action(self, action: str) -> None:
         """Send chat action to indicate bot is processing"""
         try:
-            requests.post(self.action_url, {
+            self._request("sendChatAction", lambda token: {"data": {
                 "chat_id": self.chat_id,
                 "action": action
-            })
+            }})
         except Exception as e:
             print(f"Failed to send chat action: {e}")
 
@@ -49,21 +222,25 @@ class TelegramHandler:
             try:
                 self._send_chat_action("upload_photo")
                 
-                response = requests.post(
-                    self.photo_url,
-                    params={
-                        "chat_id": self.chat_id,
-                        "photo": photo_url,
-                        "caption": caption,
-                        "parse_mode": self.parse_mode,
-                        "disable_notification": not self.enable_notification
+                def build(token):
+                    media_params, files = self._media_payload(token, "photo", photo_url)
+                    return {
+                        "params": {
+                            "chat_id": self.chat_id,
+                            **media_params,
+                            "caption": caption,
+                            "parse_mode": self.parse_mode,
+                            "disable_notification": not self.enable_notification
+                        },
+                        "files": files
                     }
-                )
-                response.raise_for_status()
+
+                self._request("sendPhoto", build, self._remember([photo_url]))
                 return True
                 
             except Exception as e:
                 print(f"Photo send failed (attempt {attempt + 1}): {e}")
+                self.last_error = f"Photo send failed: {e}"
                 if attempt < self.MAX_RETRIES - 1:
                     time.sleep(4)
         return False
@@ -77,20 +254,33 @@ class TelegramHandler:
             try:
                 self._send_chat_action("upload_photo")
                 
-                response = requests.post(
-                    self.media_group_url,
-                    json={
-                        "chat_id": self.chat_id,
-                        "media": media_items,
-                        "disable_notification": not self.enable_notification
+                def build(token):
+                    # Local files are uploaded as attachments referenced from the media list
+                    media, files = [], {}
+                    for index, media_item in enumerate(media_items):
+                        media_params, media_files = self._media_payload(token, f"file{index}", media_item["media"])
+                        if media_files:
+                            files.update(media_files)
+                            media_item = {**media_item, "media": f"attach://file{index}"}
+                        else:
+                            media_item = {**media_item, "media": media_params[f"file{index}"]}
+                        media.append(media_item)
+                    return {
+                        "data": {
+                            "chat_id": self.chat_id,
+                            "media": json.dumps(media),
+                            "disable_notification": json.dumps(not self.enable_notification)
+                        },
+                        "files": files or None
                     }
-                )
-                response.raise_for_status()
+
+                self._request("sendMediaGroup", build, self._remember([item["media"] for item in media_items]))
                 print(f"Successfully sent media group with {len(media_items)} items")
                 return True
                 
             except Exception as e:
                 print(f"Media group send failed (attempt {attempt + 1}): {e}")
+                self.last_error = f"Media group send failed: {e}"
                 if attempt < self.MAX_RETRIES - 1:
                     time.sleep(4)
         return False
@@ -146,23 +336,27 @@ class TelegramHandler:
                 elif 720 < resolution < 1000:
                     resolution = 720
                 
-                response = requests.post(
-                    self.video_url,
-                    params={
-                        "chat_id": self.chat_id,
-                        "video": video_url,
-                        "caption": title,
-                        "supports_streaming": "true",
-                        "disable_notification": not self.enable_notification,
-                        "parse_mode": self.parse_mode
-                    },
-                    allow_redirects=True
-                )
-                response.raise_for_status()
+                def build(token):
+                    media_params, files = self._media_payload(token, "video", video_url)
+                    return {
+                        "params": {
+                            "chat_id": self.chat_id,
+                            **media_params,
+                            "caption": title,
+                            "supports_streaming": "true",
+                            "disable_notification": not self.enable_notification,
+                            "parse_mode": self.parse_mode
+                        },
+                        "files": files,
+                        "allow_redirects": True
+                    }
+
+                self._request("sendVideo", build, self._remember([video_url]))
                 return True
                 
             except Exception as e:
                 print(f"Video send failed (attempt {attempt + 1}): {e}")
+                self.last_error = f"Video send failed: {e}"
                 if attempt < self.MAX_RETRIES - 1:
                     time.sleep(4)
                     resolution = int(resolution / 1.5)
@@ -174,21 +368,25 @@ class TelegramHandler:
             try:
                 self._send_chat_action("upload_video")
                 
-                response = requests.post(
-                    self.animation_url,
-                    params={
-                        "chat_id": self.chat_id,
-                        "animation": animation_url,
-                        "caption": title,
-                        "parse_mode": self.parse_mode,
-                        "disable_notification": not self.enable_notification
+                def build(token):
+                    media_params, files = self._media_payload(token, "animation", animation_url)
+                    return {
+                        "params": {
+                            "chat_id": self.chat_id,
+                            **media_params,
+                            "caption": title,
+                            "parse_mode": self.parse_mode,
+                            "disable_notification": not self.enable_notification
+                        },
+                        "files": files
                     }
-                )
-                response.raise_for_status()
+
+                self._request("sendAnimation", build, self._remember([animation_url]))
                 return True
                 
             except Exception as e:
                 print(f"Animation send failed (attempt {attempt + 1}): {e}")
+                self.last_error = f"Animation send failed: {e}"
                 if attempt < self.MAX_RETRIES - 1:
                     time.sleep(4)
         return False